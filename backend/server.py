@@ -1,20 +1,482 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Header, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.datastructures import MutableHeaders
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from pymongo import MongoClient
+from PIL import Image, ImageOps
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import boto3
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, deque
+import asyncio
+import base64
+import gzip
+import bisect
+import hashlib
+import heapq
+import hmac
+import io
+import ipaddress
+import itertools
+import json
+import logging
+import math
+import mimetypes
 import os
-import uuid
+import random
+import re
 import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zlib
 from pathlib import Path
 
-app = FastAPI()
+logger = logging.getLogger("wall_of_love")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Come up even if Mongo is not there yet; Motor reconnects on its own
+    # and setup keeps being retried in the background
+    setup_task = None
+    if not await setup_database():
+        setup_task = asyncio.create_task(setup_database_loop())
+    elif WALL_SNAPSHOT:
+        try:
+            await wall_snapshots.get(DEFAULT_WALL_ID).load()
+        except Exception as e:
+            logger.warning("Could not load the default wall snapshot: %s", e)
+    await events_broker.start(events_hub)
+    blob_gc_task = asyncio.create_task(blob_gc_loop())
+    snapshot_task = asyncio.create_task(snapshot_refresh_loop()) if WALL_SNAPSHOT else None
+    position_task = asyncio.create_task(position_buffer.run()) if POSITION_COALESCE else None
+    yield
+    if setup_task:
+        setup_task.cancel()
+    blob_gc_task.cancel()
+    if snapshot_task:
+        snapshot_task.cancel()
+    if position_task:
+        position_task.cancel()
+        try:
+            await position_buffer.flush()
+        except Exception as e:
+            logger.warning("Could not write pending positions on shutdown: %s", e)
+    await events_broker.stop()
+    image_pool.shutdown(wait=False, cancel_futures=True)
+    password_pool.shutdown()
+    client.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Upload Limits
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Headroom for multipart boundaries and part headers around the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+class UploadTooLarge(HTTPException):
+    # An HTTPException so FastAPI's form parsing passes it through as a 413
+    # instead of wrapping it in a 400
+    def __init__(self):
+        super().__init__(status_code=413, detail="File too large")
+
+class UploadLimitMiddleware:
+    # FastAPI parses the whole multipart body before the route runs, so the
+    # cap has to be enforced while the body is still arriving
+    def __init__(self, app, path: str, max_bytes: int):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+        
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self._reject(send)
+        
+        received = 0
+        response_started = False
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadTooLarge()
+            return message
+        
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadTooLarge:
+            if not response_started:
+                await self._reject(send)
+    
+    async def _reject(self, send):
+        body = json.dumps({"detail": "File too large"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+app.add_middleware(UploadLimitMiddleware, path="/api/upload", max_bytes=UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD)
+
+# Compression
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+# Larger one-shot bodies are compressed on the threadpool instead of the event loop
+COMPRESS_THREADPOOL_BYTES = 256 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+# Images are already compressed and event streams must not be buffered
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/css", "application/javascript")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def available_encodings() -> tuple:
+    # In order of preference
+    return tuple(
+        encoding for encoding, available in (("br", brotli), ("zstd", zstandard), ("gzip", True)) if available
+    )
+
+def accepted_encoding(header: Optional[str]) -> Optional[str]:
+    # Preferred content coding we can produce, honouring q=0 exclusions
+    offered = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    for encoding in available_encodings():
+        if offered.get(encoding, offered.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+def stream_compressor(encoding: str):
+    # (process, finish) pair for a body that arrives in chunks
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        return compressor.compress, compressor.flush
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return compressor.compress, compressor.flush
+
+def coded_etag(etag: str, encoding: str) -> str:
+    # A compressed representation needs its own strong validator;
+    # etag_matches strips the suffix again when comparing
+    return etag[:-1] + f'-{encoding}"' if etag.endswith('"') else etag
+
+class CompressionMiddleware:
+    # Negotiated compression for text responses at or above min_bytes.
+    # Responses that already carry a Content-Encoding (the precompressed
+    # wall snapshot) pass through untouched.
+    def __init__(self, app, min_bytes: int):
+        self.app = app
+        self.min_bytes = min_bytes
+    
+    def eligible(self, message) -> bool:
+        if message["status"] < 200 or message["status"] in (204, 304):
+            return False
+        headers = MutableHeaders(raw=message["headers"])
+        if "content-encoding" in headers:
+            return False
+        if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+            return False
+        length = headers.get("content-length")
+        return not (length and length.isdigit() and int(length) < self.min_bytes)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = accepted_encoding(dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        
+        held_start = None  # response start, held until the first body chunk decides
+        stream = None
+        
+        async def compressing_send(message):
+            nonlocal held_start, stream
+            if message["type"] == "http.response.start":
+                if self.eligible(message):
+                    held_start = message
+                    return
+                return await send(message)
+            if message["type"] != "http.response.body" or (held_start is None and stream is None):
+                return await send(message)
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if held_start is not None:
+                start, held_start = held_start, None
+                headers = MutableHeaders(raw=start["headers"])
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("Accept-Encoding")
+                if not more_body and len(body) < self.min_bytes:
+                    await send(start)
+                    return await send(message)
+                
+                headers["Content-Encoding"] = encoding
+                if "etag" in headers:
+                    headers["ETag"] = coded_etag(headers["etag"], encoding)
+                if not more_body:
+                    if len(body) >= COMPRESS_THREADPOOL_BYTES:
+                        body = await run_in_threadpool(compress_body, body, encoding)
+                    else:
+                        body = compress_body(body, encoding)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": body})
+                
+                del headers["content-length"]
+                stream = stream_compressor(encoding)
+                await send(start)
+            
+            process, finish = stream
+            chunk = process(body)
+            if not more_body:
+                chunk += finish()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        
+        await self.app(scope, receive, compressing_send)
+
+app.add_middleware(CompressionMiddleware, min_bytes=COMPRESS_MIN_BYTES)
+
+# Rate Limiting
+# Token buckets per client and route group: a bucket holds up to `limit`
+# requests and refills at limit/period per second. Signed-in clients are
+# counted by user id, everyone else by address; sign-in and registration are
+# always counted by address. Buckets live in each worker's memory, or in
+# Redis (RATE_LIMIT_REDIS_URL) so that all workers share one budget.
+# Behind a proxy or ingress every request comes from the proxy's address, so
+# limiting stays off until RATE_LIMIT_TRUSTED_PROXIES lists the proxies
+# (addresses or networks, comma separated) whose X-Forwarded-For is believed.
+# RATE_LIMIT=1 turns it on for a server that clients reach directly.
+RATE_LIMIT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(proxy.strip(), strict=False)
+    for proxy in os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '').split(',') if proxy.strip()
+]
+RATE_LIMIT = os.environ.get('RATE_LIMIT', '1' if RATE_LIMIT_TRUSTED_PROXIES else '0') == '1'
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+# (name, methods, path, default "limit/period seconds"), first match wins.
+# RATE_LIMIT_<NAME> overrides a budget; 0 turns that group off.
+RATE_LIMIT_RULES = [
+    ("login", {"POST"}, r"/api/auth/(login|register)", "10/60"),
+    ("upload", {"POST"}, r"/api/(upload|uploads/presign|uploads/complete)", "30/60"),
+    ("archive", {"GET", "POST"}, r"/api(/walls/[^/]+)?/(export|import)", "5/60"),
+    ("write", {"POST", "PUT", "PATCH", "DELETE"}, r"/api(/walls/[^/]+)?/items(/.*)?", "1200/60"),
+    ("read", {"GET"}, r"/api(/walls/[^/]+)?/items(/.*)?", "600/60"),
+]
+
+class RateLimit:
+    def __init__(self, name: str, methods: set, path: str, budget: str):
+        limit, _, period = budget.partition("/")
+        self.name = name
+        self.methods = methods
+        self.path = re.compile(path + "$")
+        self.limit = int(limit)
+        self.rate = self.limit / float(period or 1)  # tokens per second
+    
+    def matches(self, scope) -> bool:
+        return scope["method"] in self.methods and self.path.match(scope["path"]) is not None
+
+def rate_limits() -> List[RateLimit]:
+    limits = []
+    for name, methods, path, budget in RATE_LIMIT_RULES:
+        budget = os.environ.get(f"RATE_LIMIT_{name.upper()}", budget)
+        if budget != "0":
+            limits.append(RateLimit(name, methods, path, budget))
+    return limits
+
+class LocalRateLimiter:
+    # Buckets in this worker's memory, least recently used dropped first;
+    # a dropped bucket comes back full
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, monotonic time)
+        self.errors = 0
+    
+    async def take(self, key: str, limit: RateLimit) -> float:
+        # Tokens left after taking one, or negative if there was none to take
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (limit.limit, now))
+        tokens = min(limit.limit, tokens + (now - updated) * limit.rate)
+        remaining = tokens - 1
+        self.buckets[key] = (remaining if remaining >= 0 else tokens, now)
+        self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return remaining
+    
+    def stats(self) -> dict:
+        return {"backend": "local", "keys": len(self.buckets), "errors": self.errors}
+
+class RedisRateLimiter:
+    # One hash per bucket, refilled and taken from atomically by a script.
+    # Redis trouble lets requests through rather than failing them.
+    SCRIPT = """
+    local limit, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or limit
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(limit, tokens + math.max(0, now - updated) * rate)
+    local remaining = tokens - 1
+    if remaining >= 0 then tokens = remaining end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(limit / rate) + 1)
+    return tostring(remaining)
+    """
+    
+    def __init__(self, url: str, prefix: str):
+        self.redis = redis_asyncio.from_url(url)
+        self.script = self.redis.register_script(self.SCRIPT)
+        self.prefix = prefix
+        self.errors = 0
+    
+    async def take(self, key: str, limit: RateLimit) -> float:
+        try:
+            return float(await self.script(keys=[self.prefix + key], args=[limit.limit, limit.rate, time.time()]))
+        except Exception:
+            self.errors += 1
+            return float(limit.limit)
+    
+    def stats(self) -> dict:
+        return {"backend": "redis", "errors": self.errors}
+
+def trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in RATE_LIMIT_TRUSTED_PROXIES)
+
+def client_address(scope) -> str:
+    # The nearest address in X-Forwarded-For that is not one of our proxies;
+    # entries further left were written by the client and prove nothing
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if not trusted_proxy(address):
+        return address
+    forwarded = b",".join(value for name, value in scope["headers"] if name == b"x-forwarded-for")
+    for hop in reversed(forwarded.decode("latin-1").split(",")):
+        hop = hop.strip()
+        if hop:
+            address = hop
+            if not trusted_proxy(hop):
+                break
+    return address
+
+async def rate_limit_key(scope, limit: RateLimit) -> str:
+    if limit.name != "login":
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                payload = token_payload(token.strip()) if scheme.lower() == "bearer" else None
+                user = payload and payload.get("sub") and await load_user(payload["sub"])
+                if user:
+                    return f"{limit.name}:user:{user['id']}"
+                break
+    return f"{limit.name}:ip:{client_address(scope)}"
+
+if RATE_LIMIT_REDIS_URL and redis_asyncio is None:
+    logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+if RATE_LIMIT_REDIS_URL and redis_asyncio is not None:
+    rate_limiter = RedisRateLimiter(RATE_LIMIT_REDIS_URL, "wall_of_love:rate:")
+else:
+    rate_limiter = LocalRateLimiter(RATE_LIMIT_MAX_KEYS)
+rate_limit_results = Counter()  # (group, allowed|limited) -> count
+
+class RateLimitMiddleware:
+    # Inside CORS, so browsers can read a 429 and its Retry-After
+    def __init__(self, app, limits: List[RateLimit]):
+        self.app = app
+        self.limits = limits
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = next((limit for limit in self.limits if limit.matches(scope)), None)
+        if limit is None:
+            return await self.app(scope, receive, send)
+        
+        remaining = await rate_limiter.take(await rate_limit_key(scope, limit), limit)
+        headers = {
+            "X-RateLimit-Limit": str(limit.limit),
+            "X-RateLimit-Remaining": str(max(int(remaining), 0)),
+            # Seconds until the bucket is full again
+            "X-RateLimit-Reset": str(math.ceil((limit.limit - max(remaining, 0)) / limit.rate)),
+        }
+        if remaining < 0:
+            rate_limit_results[(limit.name, "limited")] += 1
+            headers["Retry-After"] = str(math.ceil(-remaining / limit.rate))
+            response = JSONResponse({"detail": "Too many requests, please retry shortly"}, status_code=429, headers=headers)
+            return await response(scope, receive, send)
+        rate_limit_results[(limit.name, "allowed")] += 1
+        
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
+
+if RATE_LIMIT:
+    app.add_middleware(RateLimitMiddleware, limits=rate_limits())
 
 # CORS Configuration
 app.add_middleware(
@@ -23,29 +485,2100 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Next-Cursor", "X-Items-Version", "X-Profile-Id", "X-Total-Count", "X-Total-Count-Truncated",
+        "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset",
+    ],
 )
 
+# Profiling
+# Opt-in wall-clock stack sampling. A profiled request is sampled from a
+# background thread: when its task is running, the event loop thread's real
+# stack is recorded; when it is suspended, its chain of awaiting coroutines is
+# recorded with an [awaiting] leaf, which covers Mongo, the threadpools and
+# the process pools. Finished profiles live in a bounded ring buffer.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # enables X-Profile-Token requests and /api/admin/profiles
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', 0.005))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 30))
+PROFILE_RETENTION = int(os.environ.get('PROFILE_RETENTION', 50))
+
+if PROFILE_SAMPLE_RATE and not PROFILE_TOKEN:
+    # Sampled profiles could never be read back
+    logger.warning("PROFILE_SAMPLE_RATE is set but PROFILE_TOKEN is not; request sampling stays off")
+    PROFILE_SAMPLE_RATE = 0.0
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def running_frames(frame) -> list:
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+def awaiting_frames(coro) -> list:
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is not None:
+            frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, task: asyncio.Task, root_frame):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.task = task
+        self.root_frame = root_frame
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.status = None
+        self.samples = Counter()  # stack of frame labels, root first -> sample count
+    
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": datetime.utcfromtimestamp(self.started_at).isoformat(),
+            "duration_ms": round(self.duration * 1000, 2),
+            "samples": sum(self.samples.values()),
+        }
+    
+    def collapsed(self) -> str:
+        # Brendan Gregg's folded format, one "a;b;c count" line per stack
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+    
+    def speedscope(self) -> dict:
+        frames, indexes, samples, weights = [], {}, [], []
+        for stack, count in self.samples.items():
+            for label in stack:
+                if label not in indexes:
+                    indexes[label] = len(frames)
+                    frames.append({"name": label})
+            samples.append([indexes[label] for label in stack])
+            weights.append(count * PROFILE_INTERVAL_SECONDS)
+        name = f"{self.method} {self.path}"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "wall_of_love",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+class Profiler:
+    def __init__(self, interval: float, retention: int):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = {}
+        self.finished = deque(maxlen=retention)
+        self.loop_thread_id = None
+        self.thread = None
+    
+    def start(self, method: str, path: str) -> RequestProfile:
+        # Called from the request's own coroutine, so the caller's frame is
+        # the root every sample is trimmed to
+        profile = RequestProfile(method, path, asyncio.current_task(), sys._getframe(1))
+        with self.lock:
+            self.loop_thread_id = threading.get_ident()
+            self.active[profile.id] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self.thread.start()
+        return profile
+    
+    def finish(self, profile: RequestProfile):
+        # When the request ends, or from the sampler once the profile has run
+        # PROFILE_MAX_SECONDS, whichever comes first
+        with self.lock:
+            if self.active.pop(profile.id, None) is None:
+                return
+            profile.duration = time.perf_counter() - profile.started
+            # Drop frame and task references so nothing is kept alive
+            profile.task = profile.root_frame = None
+            self.finished.append(profile)
+    
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self.lock:
+            return next((p for p in self.finished if p.id == profile_id), None)
+    
+    def summaries(self) -> List[dict]:
+        with self.lock:
+            return [profile.summary() for profile in reversed(self.finished)]
+    
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                profiles = list(self.active.values())
+                loop_frame = sys._current_frames().get(self.loop_thread_id)
+            running = running_frames(loop_frame)
+            now = time.perf_counter()
+            for profile in profiles:
+                root, task = profile.root_frame, profile.task
+                if now - profile.started > PROFILE_MAX_SECONDS:
+                    self.finish(profile)
+                    continue
+                if root is None or task is None:
+                    continue
+                if root in running:
+                    frames, leaf = running[running.index(root):], ()
+                else:
+                    frames, leaf = awaiting_frames(task.get_coro()), ("[awaiting]",)
+                    if root not in frames:
+                        continue
+                    frames = frames[frames.index(root):]
+                stack = tuple(frame_label(frame) for frame in frames) + leaf
+                with self.lock:
+                    if profile.id in self.active:
+                        profile.samples[stack] += 1
+            time.sleep(self.interval)
+
+profiler = Profiler(PROFILE_INTERVAL_SECONDS, PROFILE_RETENTION)
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    def wanted(self, scope) -> bool:
+        if PROFILE_TOKEN:
+            token = dict(scope["headers"]).get(b"x-profile-token")
+            if token and hmac.compare_digest(token, PROFILE_TOKEN.encode()):
+                return True
+        # Event streams stay open for as long as the page does
+        if scope["path"].endswith("/events"):
+            return False
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.wanted(scope):
+            return await self.app(scope, receive, send)
+        
+        profile = profiler.start(scope["method"], scope["path"])
+        
+        async def tagging_send(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, tagging_send)
+        finally:
+            profiler.finish(profile)
+
+app.add_middleware(ProfilingMiddleware)
+
+# Metrics
+# Per-process counters, exposed in Prometheus text format at /api/metrics.
+# With several workers each one reports its own series.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class LatencyStats:
+    # Running count, total, worst case and histogram buckets; cheap enough to update per request
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+    
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+    
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+class MongoCommandTimer(monitoring.CommandListener):
+    # Motor runs pymongo on its own threads, so these callbacks are not on the event loop
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.failures = Counter()
+    
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        self.observe(event.command_name, event.duration_micros)
+    
+    def failed(self, event):
+        self.observe(event.command_name, event.duration_micros)
+        with self.lock:
+            self.failures[event.command_name] += 1
+    
+    def observe(self, command: str, duration_micros: int):
+        with self.lock:
+            self.latency.setdefault(command, LatencyStats()).observe(duration_micros / 1e6)
+
+# (method, route template) -> LatencyStats, and (method, route template, status) -> count
+route_latency = {}
+route_responses = Counter()
+requests_in_flight = 0
+upload_bytes_received = 0
+upload_results = Counter()  # stored, deduplicated, rejected
+mongo_timer = MongoCommandTimer()
+
+class RouteTimingMiddleware:
+    # Keyed by route template rather than raw path, so /api/items/{item_id}
+    # is one series however many items there are
+    def __init__(self, app):
+        self.app = app
+        self.routes = None
+    
+    def route(self, scope) -> str:
+        if self.routes is None:
+            self.routes = {}
+            for route in app.routes:
+                if hasattr(route, "endpoint"):
+                    self.routes.setdefault(route.endpoint, []).append(route)
+        # One handler can serve several templates (/api/items and /api/walls/{wall_id}/items)
+        for route in self.routes.get(scope.get("endpoint"), []):
+            if route.path_regex.match(scope["path"]):
+                return route.path
+        return "unmatched"
+    
+    async def __call__(self, scope, receive, send):
+        global requests_in_flight
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        status_code = 500
+        
+        async def tracking_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        requests_in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, tracking_send)
+        finally:
+            requests_in_flight -= 1
+            # The router has filled in scope["endpoint"] by now
+            key = (scope["method"], self.route(scope))
+            route_latency.setdefault(key, LatencyStats()).observe(time.perf_counter() - started)
+            route_responses[(*key, status_code)] += 1
+
+app.add_middleware(RouteTimingMiddleware)
+
 # MongoDB Connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URL)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 200))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 10))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+
+# A single Motor client per process; requests borrow sockets from its pool
+# instead of holding a threadpool slot while waiting on Mongo.
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    event_listeners=[mongo_timer],
+)
 db = client['wall_of_love']
 users_collection = db['users']
 items_collection = db['items']
+counters_collection = db['counters']
+blobs_collection = db['blobs']
+walls_collection = db['walls']
+
+# Items from before walls existed, and the legacy /api/items routes, belong here
+DEFAULT_WALL_ID = "default"
+
+# Soft-deleted items stay behind as tombstones so delta sync can report them
+LIVE_ITEMS = {"deleted": {"$ne": True}}
+
+# Keyset pagination walks (created_at, id); viewport queries range over position x/y
+ITEMS_LIST_INDEX = [("created_at", 1), ("id", 1)]
+ITEMS_VIEWPORT_INDEX = [("position.x", 1), ("position.y", 1)]
+ITEMS_PAGE_MAX = int(os.environ.get('ITEMS_PAGE_MAX', 1000))
+ITEMS_BATCH_MAX = int(os.environ.get('ITEMS_BATCH_MAX', 500))
+
+# Versions are allocated before the write lands, so a concurrent writer can
+# commit a lower version after a poll has already moved past it. Delta sync
+# replays this many versions behind `since` to pick such stragglers up.
+CHANGES_REPLAY_WINDOW = int(os.environ.get('CHANGES_REPLAY_WINDOW', 20))
+
+# Indexes the hot queries depend on, created at startup. create_index is a
+# no-op for an index that already exists with the same definition. Every item
+# query is scoped to one wall, so wall_id leads each compound index and a
+# query only ever walks its own wall's entries.
+INDEXES = [
+    (items_collection, [("id", 1)], {"name": "id", "unique": True}),
+    (items_collection, [("wall_id", 1), *ITEMS_LIST_INDEX], {"name": "wall_created_at_id"}),
+    (items_collection, [("wall_id", 1), *ITEMS_VIEWPORT_INDEX], {"name": "wall_position_xy"}),
+    (items_collection, [("wall_id", 1), ("version", 1)], {"name": "wall_version"}),
+    # Search fallback while a wall's snapshot is not loaded
+    (
+        items_collection,
+        [("wall_id", 1), ("caption", "text"), ("content", "text")],
+        {"name": "wall_text", "weights": {"caption": 2, "content": 1}, "default_language": "none"},
+    ),
+    (walls_collection, [("id", 1)], {"name": "id", "unique": True}),
+    (walls_collection, [("created_at", 1)], {"name": "created_at"}),
+    (users_collection, [("email", 1)], {"name": "email", "unique": True}),
+    (blobs_collection, [("refs", 1), ("updated_at", 1)], {"name": "refs_updated_at"}),
+]
+
+# (collection, old index, replacement): pre-wall indexes, dropped once their
+# wall-scoped replacement exists
+OBSOLETE_INDEXES = [
+    (items_collection, "created_at_id", "wall_created_at_id"),
+    (items_collection, "position_xy", "wall_position_xy"),
+    (items_collection, "version", "wall_version"),
+]
+
+async def ensure_indexes():
+    created = set()
+    for collection, keys, options in INDEXES:
+        try:
+            await collection.create_index(keys, **options)
+            created.add((collection.name, options["name"]))
+        except OperationFailure as e:
+            # Typically existing duplicates blocking a unique index; keep
+            # going so the other indexes still get built
+            logger.error("Could not create index %s.%s: %s", collection.name, options["name"], e)
+    
+    existing = {}
+    for collection, name, replacement in OBSOLETE_INDEXES:
+        if collection.name not in existing:
+            existing[collection.name] = set(await collection.index_information())
+        if name in existing[collection.name] and (collection.name, replacement) in created:
+            try:
+                await collection.drop_index(name)
+            except Exception as e:
+                logger.warning("Could not drop index %s.%s: %s", collection.name, name, e)
+
+# Query Plan Verification
+QUERY_PLAN_CHECK = os.environ.get('QUERY_PLAN_CHECK', '1') == '1'
+query_plan_report = {"checked": 0, "violations": []}
+
+def hot_queries() -> list:
+    # (label, cursor shaped like the real query, index names that may serve it)
+    wall = {"wall_id": DEFAULT_WALL_ID}
+    return [
+        ("items by id", items_collection.find({"id": "", **LIVE_ITEMS}).limit(1), {"id"}),
+        ("items page", items_collection.find({**wall, **LIVE_ITEMS}).sort(ITEMS_LIST_INDEX).limit(1), {"wall_created_at_id"}),
+        (
+            "items viewport",
+            items_collection.find({**wall, **LIVE_ITEMS, "position.x": {"$gte": 0, "$lte": 1}}).sort(ITEMS_LIST_INDEX),
+            {"wall_position_xy", "wall_created_at_id"},
+        ),
+        ("items changes", items_collection.find({**wall, "version": {"$gt": 0}}).sort("version", 1), {"wall_version"}),
+        ("items search", items_collection.find({**wall, "$text": {"$search": "love"}}), {"wall_text"}),
+        ("walls by id", walls_collection.find({"id": ""}).limit(1), {"id"}),
+        ("users by email", users_collection.find({"email": ""}).limit(1), {"email"}),
+        ("stale blobs", blobs_collection.find({"refs": {"$lte": 0}, "updated_at": {"$lt": ""}}), {"refs_updated_at"}),
+    ]
+
+def plan_stages(plan: dict):
+    yield plan
+    for child in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        if child in plan:
+            yield from plan_stages(plan[child])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+async def verify_query_plans():
+    checked = 0
+    violations = []
+    for label, cursor, expected in hot_queries():
+        try:
+            explain = await cursor.explain()
+        except Exception as e:
+            logger.warning("Could not explain %s: %s", label, e)
+            continue
+        checked += 1
+        stages = list(plan_stages(explain["queryPlanner"]["winningPlan"]))
+        used = {stage["indexName"] for stage in stages if stage.get("indexName")}
+        if not used & expected:
+            violation = {"query": label, "expected": sorted(expected), "used": sorted(used) or ["COLLSCAN"]}
+            violations.append(violation)
+            logger.warning("Query %s does not use %s (plan uses %s)", label, violation["expected"], violation["used"])
+    query_plan_report.update(checked=checked, violations=violations)
+
+# Database Setup
+# Migrations and indexes have to be in place before the API is ready; the
+# unique email index is what keeps duplicate accounts out. The API still
+# comes up before Mongo does: setup is retried every SETUP_RETRY_SECONDS
+# and /api/ready answers 503 until it has gone through.
+SETUP_RETRY_SECONDS = float(os.environ.get('SETUP_RETRY_SECONDS', 5))
+database_setup = {"ready": False, "attempts": 0, "error": None}
+
+async def setup_database() -> bool:
+    database_setup["attempts"] += 1
+    try:
+        await client.admin.command("ping")
+        await migrate_walls()
+        await ensure_indexes()
+        if QUERY_PLAN_CHECK:
+            await verify_query_plans()
+    except Exception as e:
+        database_setup["error"] = str(e) or type(e).__name__
+        logger.warning("Database setup failed (attempt %d): %s", database_setup["attempts"], e)
+        return False
+    database_setup.update(ready=True, error=None)
+    return True
+
+async def setup_database_loop():
+    while not await setup_database():
+        await asyncio.sleep(SETUP_RETRY_SECONDS)
+
+def items_counter_id(wall_id: str) -> str:
+    # Each wall numbers its own versions; the default wall keeps the counter
+    # it had before walls existed, so clients mid delta sync carry on
+    return "items" if wall_id == DEFAULT_WALL_ID else f"items:{wall_id}"
+
+async def next_items_versions(wall_id: str, count: int) -> range:
+    # Reserve a block of consecutive versions in one round trip
+    counter = await counters_collection.find_one_and_update(
+        {"_id": items_counter_id(wall_id)},
+        {"$inc": {"seq": count}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return range(counter["seq"] - count + 1, counter["seq"] + 1)
+
+async def next_items_version(wall_id: str) -> int:
+    return (await next_items_versions(wall_id, 1))[0]
+
+async def items_counter(wall_id: str) -> dict:
+    counter = await counters_collection.find_one({"_id": items_counter_id(wall_id)})
+    return counter or {"seq": 0}
+
+async def current_items_version(wall_id: str) -> int:
+    return (await items_counter(wall_id))["seq"]
+
+async def items_written(wall_id: str):
+    # seq is reserved before a write lands and can stay put while a late
+    # writer changes the wall under it. The generation moves once writes
+    # have landed, so list and changes validators follow the data.
+    await counters_collection.update_one(
+        {"_id": items_counter_id(wall_id)},
+        {"$inc": {"generation": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+def items_validator(counter: dict) -> str:
+    return f"{counter['seq']}.{counter.get('generation', 0)}"
+
+# HTTP Caching
+# Upload names are content hashes (or random for older uploads), so a URL's
+# bytes never change and browsers can keep them forever
+UPLOAD_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def strip_coding(etag: str) -> str:
+    for encoding in ("br", "zstd", "gzip"):
+        if etag.endswith(f'-{encoding}"'):
+            return etag[:-len(encoding) - 2] + '"'
+    return etag
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison; any content coding of the
+    # representation is as current as the representation itself
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(strip_coding(tag.removeprefix("W/")) == etag for tag in candidates)
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+# JSON Encoding
+# orjson is optional; without it responses still skip FastAPI's
+# jsonable_encoder pass and go straight through the stdlib encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+
+# What the wall canvas renders, plus created_at for pagination cursors
+CANVAS_FIELDS = {
+    "_id": 0, "id": 1, "type": 1, "content": 1, "image_url": 1, "caption": 1, "position": 1,
+    "background_color": 1, "width": 1, "height": 1, "placeholder": 1, "variants": 1,
+    "version": 1, "created_at": 1,
+}
+
+def dumps_json(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+class FastJSONResponse(Response):
+    # Return it directly from a route; a returned dict would still go
+    # through jsonable_encoder first
+    media_type = "application/json"
+    
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+async def stream_json_array(cursor):
+    # Encode documents as the cursor yields them, so memory stays flat
+    # however large the result is
+    buffer = bytearray(b"[")
+    first = True
+    async for document in cursor:
+        if not first:
+            buffer += b","
+        first = False
+        buffer += dumps_json(document)
+        if len(buffer) >= JSON_STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    yield bytes(buffer)
+
+def parse_byte_range(header: Optional[str], size: int):
+    # Single ranges only; anything else falls back to a full response
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            length = int(end)
+            start, end = max(size - length, 0), size - 1
+        else:
+            start, end = int(start), int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end or size == 0:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+def read_file_range(path: Path, start: int, end: int):
+    with path.open("rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+# Realtime Events
+EVENTS_BROKER = os.environ.get('EVENTS_BROKER', 'local')
+EVENTS_CLIENT_QUEUE_SIZE = int(os.environ.get('EVENTS_CLIENT_QUEUE_SIZE', 256))
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+# Open event streams per wall per worker, so one busy wall cannot take every connection
+EVENTS_MAX_SUBSCRIBERS_PER_WALL = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS_PER_WALL', 1000))
+
+class EventHub:
+    # In-process fan-out. Each viewer gets its own bounded queue; dispatch never
+    # awaits, so a viewer that stops reading only ever loses its own backlog.
+    # Viewers are grouped by wall and an event only visits its own wall's queues.
+    def __init__(self, queue_size: int, max_per_wall: int):
+        self.queue_size = queue_size
+        self.max_per_wall = max_per_wall
+        self.subscribers = {}  # wall id -> set of queues
+        # In-process consumers called synchronously for every event
+        self.listeners = []
+    
+    def subscribe(self, wall_id: str) -> Optional[asyncio.Queue]:
+        # None when the wall already has as many viewers as it may
+        queues = self.subscribers.setdefault(wall_id, set())
+        if len(queues) >= self.max_per_wall:
+            return None
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        queues.add(queue)
+        return queue
+    
+    def unsubscribe(self, wall_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(wall_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[wall_id]
+    
+    def count(self) -> int:
+        return sum(len(queues) for queues in self.subscribers.values())
+    
+    def dispatch(self, event: dict):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning("Event listener failed: %s", e)
+        wall_id = event.get("wall_id")
+        for queue in list(self.subscribers.get(wall_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop what it has not read and ask it to
+                # catch up through delta sync instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+                self.unsubscribe(wall_id, queue)
+
+class LocalBroker:
+    # Single worker: events go straight to this process's hub
+    async def start(self, hub: EventHub):
+        self.hub = hub
+    
+    async def stop(self):
+        pass
+    
+    async def publish(self, event: dict):
+        self.hub.dispatch(event)
+
+class MongoChangeStreamBroker:
+    # Multiple workers: every worker tails the items change stream (needs a
+    # replica set), so writes from any worker reach every worker's viewers
+    def __init__(self, collection):
+        self.collection = collection
+        self.task = None
+    
+    async def start(self, hub: EventHub):
+        self.hub = hub
+        self.task = asyncio.create_task(self._tail())
+    
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+    
+    async def publish(self, event: dict):
+        # Our own writes come back through the change stream
+        pass
+    
+    async def _tail(self):
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(full_document="updateLookup", resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        event = change_to_event(change)
+                        if event:
+                            self.hub.dispatch(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Items change stream interrupted: %s", e)
+                await asyncio.sleep(1)
+
+def item_event(kind: str, item: dict) -> dict:
+    version = item.get("version")
+    wall_id = item.get("wall_id", DEFAULT_WALL_ID)
+    if kind == "deleted":
+        item = {"id": item["id"]}
+    return {"type": kind, "wall_id": wall_id, "version": version, "item": item}
+
+def change_to_event(change: dict) -> Optional[dict]:
+    item = change.get("fullDocument")
+    if not item or "id" not in item:
+        return None
+    item = {k: v for k, v in item.items() if k != "_id"}
+    if item.get("deleted"):
+        return item_event("deleted", item)
+    return item_event("created" if change["operationType"] == "insert" else "updated", item)
+
+async def publish_item_event(kind: str, item: dict):
+    try:
+        await events_broker.publish(item_event(kind, item))
+    except Exception as e:
+        # The write already happened; viewers will pick it up via delta sync
+        logger.warning("Failed to publish %s event: %s", kind, e)
+
+events_hub = EventHub(EVENTS_CLIENT_QUEUE_SIZE, EVENTS_MAX_SUBSCRIBERS_PER_WALL)
+if EVENTS_BROKER == 'mongo':
+    events_broker = MongoChangeStreamBroker(items_collection)
+else:
+    events_broker = LocalBroker()
+
+# Spatial Index
+# A grid hash over item footprints, kept by each loaded wall snapshot. Grid
+# cells double as placement slots: PLACEMENT_COLUMNS across and as many rows
+# as the wall needs, each PLACEMENT_CELL_SIZE canvas units square. A card
+# placed off the lattice occupies every cell it overlaps.
+PLACEMENT_COLUMNS = int(os.environ.get('PLACEMENT_COLUMNS', 5))
+PLACEMENT_CELL_SIZE = float(os.environ.get('PLACEMENT_CELL_SIZE', 300))
+PLACEMENT_MAX_ROWS = 3  # tallest image footprint, in cells
+
+# What placement needs to know about an item
+PLACEMENT_FIELDS = {"_id": 0, "id": 1, "type": 1, "position": 1, "width": 1, "height": 1, "created_at": 1}
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def item_footprint(item: dict) -> tuple:
+    # (columns, rows): one card wide, images as tall as their aspect ratio needs
+    width, height = item.get("width"), item.get("height")
+    if item.get("type") == "image" and is_number(width) and is_number(height) and width > 0:
+        return 1, min(max(math.ceil(height / width), 1), PLACEMENT_MAX_ROWS)
+    return 1, 1
+
+def item_cells(item: dict) -> tuple:
+    position = item.get("position") or {}
+    origin = []
+    for axis, slot in (("x", "gridColumn"), ("y", "gridRow")):
+        if is_number(position.get(axis)):
+            origin.append(position[axis] / PLACEMENT_CELL_SIZE)
+        elif is_number(position.get(slot)):
+            origin.append(position[slot] - 1)
+        else:
+            return ()  # not placed on the canvas
+    columns, rows = item_footprint(item)
+    (x, y) = origin
+    return tuple(
+        (column, row)
+        for column in range(math.floor(x), math.ceil(x + columns))
+        for row in range(math.floor(y), math.ceil(y + rows))
+    )
+
+def slot_position(column: int, row: int) -> dict:
+    # Both coordinate styles clients use
+    return {"x": column * PLACEMENT_CELL_SIZE, "y": row * PLACEMENT_CELL_SIZE, "gridColumn": column + 1, "gridRow": row + 1}
+
+class SpatialGrid:
+    def __init__(self):
+        self.cells = {}  # (column, row) -> ids of the items overlapping it
+        self.items = {}  # item id -> (cells, (x, y) or None, (created_at, id))
+        self.row_counts = Counter()  # row -> occupied cells among the placement columns
+    
+    def put(self, item_id: str, item: dict):
+        self.remove(item_id)
+        cells = item_cells(item)
+        position = item.get("position") or {}
+        anchor = (position["x"], position["y"]) if is_number(position.get("x")) and is_number(position.get("y")) else None
+        self.items[item_id] = (cells, anchor, (item.get("created_at") or "", item_id))
+        for cell in cells:
+            ids = self.cells.setdefault(cell, set())
+            if not ids and 0 <= cell[0] < PLACEMENT_COLUMNS:
+                self.row_counts[cell[1]] += 1
+            ids.add(item_id)
+    
+    def remove(self, item_id: str):
+        entry = self.items.pop(item_id, None)
+        if entry is None:
+            return
+        for cell in entry[0]:
+            ids = self.cells[cell]
+            ids.discard(item_id)
+            if not ids:
+                del self.cells[cell]
+                if 0 <= cell[0] < PLACEMENT_COLUMNS:
+                    self.row_counts[cell[1]] -= 1
+    
+    def within(self, x_min: float, x_max: float, y_min: float, y_max: float) -> list:
+        # Ids of items whose position lies in the rectangle, in (created_at, id)
+        # order like the database query. Only the cells under it are visited,
+        # unless it covers more cells than there are items.
+        bounds = (x_min, x_max, y_min, y_max)
+        candidates = self.items
+        if all(math.isfinite(bound) for bound in bounds):
+            columns = range(math.floor(x_min / PLACEMENT_CELL_SIZE), math.floor(x_max / PLACEMENT_CELL_SIZE) + 1)
+            rows = range(math.floor(y_min / PLACEMENT_CELL_SIZE), math.floor(y_max / PLACEMENT_CELL_SIZE) + 1)
+            if (columns.stop - columns.start) * (rows.stop - rows.start) <= len(self.items):
+                candidates = {item_id for column in columns for row in rows for item_id in self.cells.get((column, row), ())}
+        matched = []
+        for item_id in candidates:
+            anchor = self.items[item_id][1]
+            if anchor and x_min <= anchor[0] <= x_max and y_min <= anchor[1] <= y_max:
+                matched.append(item_id)
+        return sorted(matched, key=lambda item_id: self.items[item_id][2])
+    
+    def fits(self, column: int, row: int, footprint: tuple) -> bool:
+        columns, rows = footprint
+        return all((column + dc, row + dr) not in self.cells for dc in range(columns) for dr in range(rows))
+    
+    def free_slot(self, footprint: tuple, near: Optional[tuple] = None) -> tuple:
+        # (column, row) of the first free slot in reading order, or of the one
+        # nearest to canvas point `near`. Full rows are skipped on their count,
+        # and rows past the last occupied one are always free.
+        last_column = max(PLACEMENT_COLUMNS - footprint[0], 0)
+        if near is None:
+            row = 0
+            while True:
+                if self.row_counts[row] < PLACEMENT_COLUMNS:
+                    for column in range(last_column + 1):
+                        if self.fits(column, row, footprint):
+                            return column, row
+                row += 1
+        
+        start_column = min(max(math.floor(near[0] / PLACEMENT_CELL_SIZE), 0), last_column)
+        start_row = max(math.floor(near[1] / PLACEMENT_CELL_SIZE), 0)
+        columns = sorted(range(last_column + 1), key=lambda column: abs(column - start_column))
+        best, best_distance = None, math.inf
+        distance = 0
+        while distance <= best_distance:
+            for row in {start_row - distance, start_row + distance}:
+                if row < 0 or self.row_counts[row] >= PLACEMENT_COLUMNS:
+                    continue
+                for column in columns:
+                    candidate = math.hypot(column - start_column, distance)
+                    if candidate >= best_distance:
+                        break
+                    if self.fits(column, row, footprint):
+                        best, best_distance = (column, row), candidate
+                        break
+            distance += 1
+        return best
+    
+    def stats(self) -> dict:
+        return {"items": len(self.items), "cells": len(self.cells)}
+
+# Search
+# An inverted index over caption and content, kept by each loaded wall
+# snapshot like the spatial grid. Query words match indexed words they are a
+# prefix of, every query word must match, and results are ranked by field
+# weight and rarity of the matched words (prefix matches count for less).
+# Without a loaded snapshot, search falls back to the MongoDB text index,
+# which matches whole words only.
+SEARCH_FIELDS = {"caption": 2, "content": 1}  # field -> weight
+SEARCH_PAGE_MAX = int(os.environ.get('SEARCH_PAGE_MAX', 100))
+SEARCH_QUERY_MAX_LENGTH = 200
+# Words a single query word may expand to; bounds short prefixes like "a"
+SEARCH_MAX_EXPANSIONS = int(os.environ.get('SEARCH_MAX_EXPANSIONS', 200))
+SEARCH_PREFIX_WEIGHT = 0.5
+SEARCH_TOKEN = re.compile(r"\w+")
+
+def search_terms(text: str) -> list:
+    return SEARCH_TOKEN.findall(text.casefold())
+
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}  # word -> {item id: weighted frequency}
+        self.words = []  # every indexed word, sorted for prefix lookups
+        self.documents = {}  # item id -> (words, (created_at, id))
+    
+    def put(self, item_id: str, item: dict):
+        self.remove(item_id)
+        weights = Counter()
+        for field, weight in SEARCH_FIELDS.items():
+            if isinstance(item.get(field), str):
+                for word in search_terms(item[field]):
+                    weights[word] += weight
+        if not weights:
+            return
+        self.documents[item_id] = (tuple(weights), (item.get("created_at") or "", item_id))
+        for word, weight in weights.items():
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = {}
+                bisect.insort(self.words, word)
+            posting[item_id] = weight
+    
+    def remove(self, item_id: str):
+        entry = self.documents.pop(item_id, None)
+        if entry is None:
+            return
+        for word in entry[0]:
+            posting = self.postings[word]
+            del posting[item_id]
+            if not posting:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+    
+    def expand(self, prefix: str) -> tuple:
+        # (indexed words starting with prefix, whether there were more)
+        start = bisect.bisect_left(self.words, prefix)
+        words = []
+        for word in self.words[start:start + SEARCH_MAX_EXPANSIONS + 1]:
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        return words[:SEARCH_MAX_EXPANSIONS], len(words) > SEARCH_MAX_EXPANSIONS
+    
+    def scores(self, query: str) -> tuple:
+        # (item id -> score, whether a query word had too many expansions
+        # for every match to be found)
+        total = len(self.documents)
+        scores = None
+        truncated = False
+        for term in dict.fromkeys(search_terms(query)):
+            # An item's score for a query word is its best matching indexed word
+            term_scores = {}
+            words, more = self.expand(term)
+            truncated = truncated or more
+            for word in words:
+                posting = self.postings[word]
+                weight = math.log(1 + total / len(posting)) * (1 if word == term else SEARCH_PREFIX_WEIGHT)
+                for item_id, frequency in posting.items():
+                    score = frequency * weight
+                    if score > term_scores.get(item_id, 0):
+                        term_scores[item_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {item_id: scores[item_id] + score for item_id, score in term_scores.items() if item_id in scores}
+            if not scores:
+                break
+        return scores or {}, truncated
+    
+    def search(self, query: str, offset: int, limit: int) -> tuple:
+        # (number of matches, ids on the requested page, whether the matches
+        # are incomplete), best first and in wall order among equals
+        scores, truncated = self.scores(query)
+        ranked = heapq.nsmallest(
+            offset + limit, scores, key=lambda item_id: (-scores[item_id], self.documents[item_id][1])
+        )
+        return len(scores), ranked[offset:], truncated
+    
+    def stats(self) -> dict:
+        return {"items": len(self.documents), "words": len(self.words)}
+
+def encode_offset(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode().rstrip("=")
+
+def decode_offset(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded))["offset"]
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError(cursor)
+        return offset
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Wall Snapshot
+# Live walls kept in memory as per-item encoded JSON and patched by the same
+# item events that feed the event streams, so a full-wall read is a join of
+# ready-made bytes with no database call. Every worker receives every event
+# when EVENTS_BROKER=mongo; a periodic version check reloads a snapshot that
+# has fallen behind anyway. Only the most recently read walls are held.
+WALL_SNAPSHOT = os.environ.get('WALL_SNAPSHOT', '1') == '1'
+SNAPSHOT_REFRESH_SECONDS = float(os.environ.get('SNAPSHOT_REFRESH_SECONDS', 30))
+SNAPSHOT_MAX_WALLS = int(os.environ.get('SNAPSHOT_MAX_WALLS', 64))
+
+# A snapshot's ETag carries its generation, which moves on every applied
+# event; its version alone stays put when a late writer commits a version
+# below it. Generations come from one counter per process, tagged with the
+# process, so a reloaded snapshot or another worker never repeats one.
+SNAPSHOT_EPOCH = uuid.uuid4().hex[:8]
+snapshot_generations = itertools.count(1)
+
+def encode_snapshot_item(item: dict) -> dict:
+    canvas = {field: item[field] for field in CANVAS_FIELDS if field in item}
+    return {"full": dumps_json(item), "canvas": dumps_json(canvas)}
+
+class WallSnapshot:
+    def __init__(self, wall_id: str):
+        self.wall_id = wall_id
+        self.ready = False
+        self.loading = False
+        self.pending = []  # events that arrived while loading
+        self.encoded = {}  # item id -> {"full": bytes, "canvas": bytes}, in (created_at, id) order
+        self.versions = {}  # item id -> version of the event that last touched it, tombstones included
+        self.grid = SpatialGrid()
+        self.search = SearchIndex()
+        self.version = 0
+        self.seen_version = None  # counter value at the last refresh check
+        self.updated_at = time.time()
+        # Response bodies for the current generation, keyed (fields, encoding)
+        self.generation = next(snapshot_generations)
+        self.bodies = {}
+        self.tasks = {}  # (fields, encoding, generation) -> compression task
+        self.reloads = 0
+    
+    async def load(self):
+        self.loading = True
+        self.pending = []
+        try:
+            # Version first, as in get_items: replaying events up to it is harmless
+            version = await current_items_version(self.wall_id)
+            encoded, versions, grid, search = {}, {}, SpatialGrid(), SearchIndex()
+            query = {"wall_id": self.wall_id, **LIVE_ITEMS}
+            async for item in items_collection.find(query, {"_id": 0}).sort(ITEMS_LIST_INDEX):
+                encoded[item["id"]] = encode_snapshot_item(item)
+                versions[item["id"]] = item.get("version", 0)
+                grid.put(item["id"], item)
+                search.put(item["id"], item)
+        finally:
+            self.loading = False
+        self.encoded, self.versions, self.version = encoded, versions, version
+        self.grid, self.search = grid, search
+        self.ready = True
+        self.reloads += 1
+        self.invalidate()
+        pending, self.pending = self.pending, []
+        for event in pending:
+            self.apply(event)
+    
+    def apply(self, event: dict):
+        if self.loading:
+            self.pending.append(event)
+            return
+        version = event.get("version")
+        if not self.ready or version is None or event["type"] not in ("created", "updated", "deleted"):
+            return
+        item_id = event["item"]["id"]
+        # Events can arrive out of version order; never let an older one win
+        if self.versions.get(item_id, 0) > version:
+            return
+        self.versions[item_id] = version
+        if event["type"] == "deleted":
+            self.encoded.pop(item_id, None)
+            self.grid.remove(item_id)
+            self.search.remove(item_id)
+        else:
+            self.encoded[item_id] = encode_snapshot_item(event["item"])
+            self.grid.put(item_id, event["item"])
+            self.search.put(item_id, event["item"])
+        self.version = max(self.version, version)
+        self.invalidate()
+    
+    def invalidate(self):
+        self.updated_at = time.time()
+        self.generation = next(snapshot_generations)
+        self.bodies.clear()
+    
+    def etag(self, query_key: str) -> str:
+        return f"items-{self.version}-{SNAPSHOT_EPOCH}.{self.generation}-{query_key}"
+    
+    async def body(self, fields: str, encoding: Optional[str]):
+        # Returns (body, content encoding). A compressed body is built once per
+        # generation off the event loop; readers arriving meanwhile wait for
+        # that build rather than have the middleware compress it again.
+        identity = self.bodies.get((fields, None))
+        if identity is None:
+            identity = b"[" + b",".join(encoded[fields] for encoded in self.encoded.values()) + b"]"
+            self.bodies[(fields, None)] = identity
+        if encoding is None or len(identity) < COMPRESS_MIN_BYTES:
+            return identity, None
+        compressed = self.bodies.get((fields, encoding))
+        if compressed is not None:
+            return compressed, encoding
+        key = (fields, encoding, self.generation)
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.create_task(self.compress(fields, encoding, identity, self.generation))
+        # Shielded: one reader going away must not cancel the others' body
+        return await asyncio.shield(self.tasks[key]), encoding
+    
+    async def compress(self, fields: str, encoding: str, body: bytes, generation: int) -> bytes:
+        try:
+            compressed = await run_in_threadpool(compress_body, body, encoding)
+        finally:
+            self.tasks.pop((fields, encoding, generation), None)
+        if generation == self.generation:
+            self.bodies[(fields, encoding)] = compressed
+        return compressed
+    
+    def within(self, fields: str, x_min: float, x_max: float, y_min: float, y_max: float) -> bytes:
+        # Viewport reads answered from the grid; not cached, every pan differs
+        ids = self.grid.within(x_min, x_max, y_min, y_max)
+        return b"[" + b",".join(self.encoded[item_id][fields] for item_id in ids if item_id in self.encoded) + b"]"
+    
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "items": len(self.encoded),
+            "grid": self.grid.stats(),
+            "search": self.search.stats(),
+            "version": self.version,
+            "cached_bodies": sorted(f"{fields}:{encoding or 'identity'}" for fields, encoding in self.bodies),
+            "reloads": self.reloads,
+        }
+
+class WallSnapshots:
+    # One snapshot per recently read wall, least recently read evicted first,
+    # so memory follows the walls in use rather than every wall there is
+    def __init__(self, max_walls: int):
+        self.max_walls = max_walls
+        self.snapshots = OrderedDict()  # wall id -> WallSnapshot
+        self.tasks = {}  # wall id -> first load
+        self.evictions = 0
+    
+    def get(self, wall_id: str) -> WallSnapshot:
+        snapshot = self.snapshots.get(wall_id)
+        if snapshot is None:
+            snapshot = self.snapshots[wall_id] = WallSnapshot(wall_id)
+            while len(self.snapshots) > self.max_walls:
+                self.snapshots.popitem(last=False)
+                self.evictions += 1
+        self.snapshots.move_to_end(wall_id)
+        return snapshot
+    
+    def ready(self, wall_id: str) -> Optional[WallSnapshot]:
+        # The wall's snapshot if it is loaded. Otherwise start loading it in
+        # the background; the caller reads from the database meanwhile.
+        snapshot = self.get(wall_id)
+        if not snapshot.ready and not snapshot.loading and wall_id not in self.tasks:
+            self.tasks[wall_id] = asyncio.create_task(self.load(snapshot))
+        return snapshot if snapshot.ready else None
+    
+    async def load(self, snapshot: WallSnapshot):
+        try:
+            await snapshot.load()
+        except Exception as e:
+            logger.warning("Could not load snapshot of wall %s: %s", snapshot.wall_id, e)
+        finally:
+            self.tasks.pop(snapshot.wall_id, None)
+    
+    def apply(self, event: dict):
+        # Walls nobody has read lately have no snapshot to patch
+        snapshot = self.snapshots.get(event.get("wall_id"))
+        if snapshot is not None:
+            snapshot.apply(event)
+    
+    def stats(self) -> dict:
+        return {
+            "walls": {wall_id: snapshot.stats() for wall_id, snapshot in self.snapshots.items()},
+            "max_walls": self.max_walls,
+            "evictions": self.evictions,
+        }
+
+wall_snapshots = WallSnapshots(SNAPSHOT_MAX_WALLS)
+if WALL_SNAPSHOT:
+    events_hub.listeners.append(wall_snapshots.apply)
+
+async def snapshot_refresh_loop():
+    # Every version up to the one seen last round should have arrived by now.
+    # A snapshot still below it missed an event (or the write behind the
+    # version failed), so reload it from the database.
+    while True:
+        await asyncio.sleep(SNAPSHOT_REFRESH_SECONDS)
+        for snapshot in list(wall_snapshots.snapshots.values()):
+            if snapshot.loading:
+                continue
+            try:
+                seen = snapshot.seen_version
+                if not snapshot.ready or (seen is not None and snapshot.version < seen):
+                    await snapshot.load()
+                snapshot.seen_version = await current_items_version(snapshot.wall_id)
+            except Exception as e:
+                logger.warning("Snapshot refresh of wall %s failed: %s", snapshot.wall_id, e)
+
+# Write Coalescing
+# Drags send a stream of position-only updates. They are merged per item in
+# memory and written in one bulk write every POSITION_FLUSH_SECONDS, or at
+# once when the client marks the end of the drag. Every accepted change bumps
+# the item's revision and a change based on an older revision gets 409. The
+# buffer is per worker, so a flush only lands if the item is still at the
+# revision it was read at; a write made elsewhere in the meantime wins. Item
+# events from that write evict the buffered copy, and a move lost to it is
+# answered with 409 on the client's next change to the item.
+POSITION_COALESCE = os.environ.get('POSITION_COALESCE', '1') == '1'
+POSITION_FLUSH_SECONDS = float(os.environ.get('POSITION_FLUSH_SECONDS', 0.5))
+POSITION_IDLE_SECONDS = float(os.environ.get('POSITION_IDLE_SECONDS', 2))
+# How long a lost move waits to be reported
+POSITION_CONFLICT_SECONDS = float(os.environ.get('POSITION_CONFLICT_SECONDS', 60))
+
+def revision_filter(revision: int) -> dict:
+    # Items from before revisions existed are at revision 0
+    return {"revision": {"$in": [0, None]}} if revision == 0 else {"revision": revision}
+
+def stale_revision(current: int) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail="Item was changed by someone else, reload it and try again",
+        headers={"X-Item-Revision": str(current)},
+    )
+
+class PendingPosition:
+    def __init__(self, item: dict):
+        self.item = item  # as stored, plus any pending position and revision
+        self.stored_revision = item.get("revision", 0)
+        self.version = item.get("version") or 0  # newest write known to be this buffer's
+        self.dirty = False
+        self.touched = time.monotonic()
+
+class PositionBuffer:
+    def __init__(self):
+        self.pending = {}  # item id -> PendingPosition
+        self.lost = {}  # item id -> (revision now stored or None if deleted, monotonic time)
+        self.lock = asyncio.Lock()
+        self.results = Counter()  # coalesced, written, conflicts
+    
+    def lose(self, item_id: str, revision: Optional[int]):
+        self.lost[item_id] = (revision, time.monotonic())
+        self.results["conflicts"] += 1
+    
+    def check(self, item_id: str):
+        # Report a buffered move that was accepted but never landed
+        lost = self.lost.pop(item_id, None)
+        if lost is None:
+            return
+        if lost[0] is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        raise stale_revision(lost[0])
+    
+    def observe(self, event: dict):
+        # Hub listener: a newer write from anywhere else makes the buffered
+        # copy stale, so the next move has to read the item again
+        item = event.get("item") or {}
+        entry = self.pending.get(item.get("id"))
+        if entry is None or (event.get("version") or 0) <= entry.version:
+            return
+        del self.pending[item["id"]]
+        if entry.dirty:
+            self.lose(item["id"], None if event["type"] == "deleted" else item.get("revision", 0))
+    
+    async def update(self, item_id: str, wall_id: str, position: dict, revision: Optional[int], final: bool) -> dict:
+        self.check(item_id)
+        entry = self.pending.get(item_id)
+        if entry is None:
+            item = await items_collection.find_one({"id": item_id, "wall_id": wall_id, **LIVE_ITEMS}, {"_id": 0})
+            if item is None:
+                raise HTTPException(status_code=404, detail="Item not found")
+            entry = self.pending.setdefault(item_id, PendingPosition(item))
+        elif entry.item["wall_id"] != wall_id:
+            raise HTTPException(status_code=404, detail="Item not found")
+        
+        current = entry.item.get("revision", 0)
+        if revision is not None and revision != current:
+            raise stale_revision(current)
+        entry.item["position"] = position
+        entry.item["revision"] = current + 1
+        entry.dirty = True
+        entry.touched = time.monotonic()
+        self.results["coalesced"] += 1
+        
+        if final:
+            await self.flush([item_id])
+            self.check(item_id)
+        return dict(entry.item)
+    
+    async def flush(self, item_ids: Optional[List[str]] = None):
+        async with self.lock:
+            batch = []
+            for item_id in list(self.pending if item_ids is None else item_ids):
+                entry = self.pending.get(item_id)
+                if entry and entry.dirty:
+                    entry.dirty = False
+                    batch.append((item_id, entry, entry.item["revision"], entry.item["position"]))
+            if not batch:
+                return
+            
+            try:
+                by_wall = {}
+                for flushed in batch:
+                    by_wall.setdefault(flushed[1].item["wall_id"], []).append(flushed[0])
+                versions = {}
+                for wall_id, ids in by_wall.items():
+                    versions.update(zip(ids, await next_items_versions(wall_id, len(ids))))
+                # So this write's own event is not taken for someone else's
+                for item_id, entry, _, _ in batch:
+                    entry.version = versions[item_id]
+                
+                requests = [
+                    UpdateOne(
+                        {"id": item_id, **LIVE_ITEMS, **revision_filter(entry.stored_revision)},
+                        {"$set": {"position": position, "revision": revision, "version": versions[item_id]}},
+                    )
+                    for item_id, entry, revision, position in batch
+                ]
+                try:
+                    await items_collection.bulk_write(requests, ordered=False)
+                except BulkWriteError:
+                    pass  # the read-back below tells which writes landed
+                for wall_id in by_wall:
+                    await items_written(wall_id)
+                written = {}
+                async for item in items_collection.find({"id": {"$in": list(versions)}}, {"_id": 0}):
+                    written[item["id"]] = item
+            except Exception:
+                # Try again next round
+                for _, entry, _, _ in batch:
+                    entry.dirty = True
+                raise
+            
+            for item_id, entry, revision, position in batch:
+                item = written.get(item_id)
+                if item and item.get("version") == versions[item_id]:
+                    # Keep any newer position that arrived during the write
+                    entry.stored_revision = revision
+                    entry.item = {**item, "position": entry.item["position"], "revision": entry.item["revision"]}
+                    self.results["written"] += 1
+                    await publish_item_event("updated", item)
+                else:
+                    # Changed or deleted elsewhere since it was read; that write stands
+                    if self.pending.get(item_id) is entry:
+                        del self.pending[item_id]
+                    self.lose(item_id, item.get("revision", 0) if item and not item.get("deleted") else None)
+    
+    def discard(self, item_id: str):
+        self.pending.pop(item_id, None)
+    
+    async def run(self):
+        while True:
+            await asyncio.sleep(POSITION_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Position flush failed: %s", e)
+            cutoff = time.monotonic() - POSITION_IDLE_SECONDS
+            for item_id, entry in list(self.pending.items()):
+                if not entry.dirty and entry.touched < cutoff:
+                    del self.pending[item_id]
+            cutoff = time.monotonic() - POSITION_CONFLICT_SECONDS
+            for item_id, (_, lost_at) in list(self.lost.items()):
+                if lost_at < cutoff:
+                    del self.lost[item_id]
+    
+    def stats(self) -> dict:
+        return {
+            "pending": sum(1 for entry in self.pending.values() if entry.dirty),
+            "cached": len(self.pending),
+            "lost": len(self.lost),
+            **{result: self.results[result] for result in ("coalesced", "written", "conflicts")},
+        }
+
+position_buffer = PositionBuffer()
+events_hub.listeners.append(position_buffer.observe)
 
 # JWT Configuration
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 43200))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer(auto_error=False)
 
-# Create uploads directory
-UPLOADS_DIR = Path("/app/backend/uploads")
-UPLOADS_DIR.mkdir(exist_ok=True)
+# Password Hashing
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))
+PASSWORD_QUEUE_MAX = int(os.environ.get('PASSWORD_QUEUE_MAX', 32))
+PASSWORD_RETRY_AFTER_SECONDS = int(os.environ.get('PASSWORD_RETRY_AFTER_SECONDS', 2))
+
+# Stored hashes with a different cost are upgraded on the next successful login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+class PasswordPool:
+    # bcrypt releases the GIL, so a few dedicated threads are enough to keep
+    # it off both the event loop and the shared threadpool that file I/O uses.
+    # A login burst queues here up to max_pending; past that callers are
+    # turned away at once instead of waiting behind everyone else.
+    def __init__(self, workers: int, max_pending: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.wait = LatencyStats()
+        self.run = LatencyStats()
+    
+    async def submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-ins in progress, please retry shortly",
+                headers={"Retry-After": str(PASSWORD_RETRY_AFTER_SECONDS)},
+            )
+        queued_at = time.perf_counter()
+        
+        def timed():
+            started = time.perf_counter()
+            return fn(*args), started, time.perf_counter()
+        
+        # A job counts until its thread is done with it, even when the caller
+        # gives up waiting first; bcrypt cannot be interrupted
+        loop = asyncio.get_running_loop()
+        
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(self.release)
+            except RuntimeError:
+                pass  # the loop closed at shutdown
+        
+        self.pending += 1
+        job = self.executor.submit(timed)
+        job.add_done_callback(done)
+        result, started, finished = await asyncio.wrap_future(job)
+        # Recorded back on the event loop, which owns the counters
+        self.wait.observe(started - queued_at)
+        self.run.observe(finished - started)
+        return result
+    
+    def release(self):
+        self.pending -= 1
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "wait": self.wait.stats(),
+            "run": self.run.stats(),
+        }
+
+password_pool = PasswordPool(PASSWORD_WORKERS, PASSWORD_QUEUE_MAX)
+
+# Auth Cache
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TTL = float(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 10000))
+AUTH_USER_CACHE_TTL = float(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+# Optional shared tier so workers warm each other's user lookups
+AUTH_CACHE_REDIS_URL = os.environ.get('AUTH_CACHE_REDIS_URL')
+
+class TTLCache:
+    # Bounded LRU whose entries also expire; single-threaded use on the event loop
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    
+    def set(self, key, value, ttl: Optional[float] = None):
+        self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+    
+    def pop(self, key):
+        self.entries.pop(key, None)
+    
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class RedisCache:
+    # JSON values in any Redis-compatible server. It is only a cache, so
+    # errors count as misses instead of failing the request.
+    def __init__(self, url: str, prefix: str, ttl: float):
+        self.redis = redis_asyncio.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+    
+    async def get(self, key: str):
+        try:
+            raw = await self.redis.get(self.prefix + key)
+        except Exception:
+            self.errors += 1
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+    
+    async def set(self, key: str, value):
+        try:
+            await self.redis.set(self.prefix + key, json.dumps(value), ex=max(int(self.ttl), 1))
+        except Exception:
+            self.errors += 1
+    
+    async def delete(self, key: str):
+        try:
+            await self.redis.delete(self.prefix + key)
+        except Exception:
+            self.errors += 1
+    
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+# Verified JWT claims by token, and user documents (without password) by email
+token_cache = TTLCache(AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL)
+user_cache = TTLCache(AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+shared_user_cache = None
+if AUTH_CACHE_REDIS_URL:
+    if redis_asyncio is None:
+        logger.warning("AUTH_CACHE_REDIS_URL is set but the redis package is not installed")
+    else:
+        shared_user_cache = RedisCache(AUTH_CACHE_REDIS_URL, "wall_of_love:user:", AUTH_USER_CACHE_TTL)
+
+async def load_user(email: str) -> Optional[dict]:
+    user = user_cache.get(email)
+    if user is not None:
+        return user
+    if shared_user_cache:
+        user = await shared_user_cache.get(email)
+    if user is None:
+        user = await users_collection.find_one({"email": email}, {"_id": 0, "password": 0})
+        if user is None:
+            return None
+        if shared_user_cache:
+            await shared_user_cache.set(email, user)
+    user_cache.set(email, user)
+    return user
+
+async def invalidate_user(email: str):
+    # Call whenever a user document changes or is removed
+    user_cache.pop(email)
+    if shared_user_cache:
+        await shared_user_cache.delete(email)
+
+def invalidate_token(token: str):
+    token_cache.pop(token)
+
+def auth_cache_stats() -> dict:
+    stats = {"tokens": token_cache.stats(), "users": user_cache.stats()}
+    if shared_user_cache:
+        stats["shared_users"] = shared_user_cache.stats()
+    return stats
+
+# Walls
+# Each wall is its own tenant: items carry a wall_id, versions and snapshots
+# are per wall, and a wall may hold at most its item quota. The quota is
+# enforced with a conditional increment of item_count, so concurrent writers
+# can never overshoot it.
+WALL_ITEM_QUOTA = int(os.environ.get('WALL_ITEM_QUOTA', 10000))
+WALL_CACHE_SIZE = int(os.environ.get('WALL_CACHE_SIZE', 1000))
+WALL_CACHE_TTL = float(os.environ.get('WALL_CACHE_TTL', 60))
+
+# Wall documents by id; only existence is read from here, never item_count
+wall_cache = TTLCache(WALL_CACHE_SIZE, WALL_CACHE_TTL)
+
+def wall_response(wall: dict) -> dict:
+    return {k: v for k, v in wall.items() if k != "_id"}
+
+async def ensure_default_wall():
+    # Upserted rather than inserted so concurrent workers agree on one document
+    if await walls_collection.find_one({"id": DEFAULT_WALL_ID}, {"_id": 1}):
+        return
+    item_count = await items_collection.count_documents({"wall_id": DEFAULT_WALL_ID, **LIVE_ITEMS})
+    await walls_collection.update_one(
+        {"id": DEFAULT_WALL_ID},
+        {"$setOnInsert": {
+            "name": "Wall of Love",
+            "created_by": None,
+            "created_at": datetime.utcnow().isoformat(),
+            "item_quota": max(WALL_ITEM_QUOTA, item_count),
+            "item_count": item_count,
+        }},
+        upsert=True,
+    )
+
+async def migrate_walls():
+    # Items from before walls existed belong to the default wall
+    result = await items_collection.update_many({"wall_id": {"$exists": False}}, {"$set": {"wall_id": DEFAULT_WALL_ID}})
+    if result.modified_count:
+        logger.info("Moved %d items onto the default wall", result.modified_count)
+        await items_written(DEFAULT_WALL_ID)
+    await ensure_default_wall()
+
+async def load_wall(wall_id: str) -> Optional[dict]:
+    wall = wall_cache.get(wall_id)
+    if wall is not None:
+        return wall
+    wall = await walls_collection.find_one({"id": wall_id}, {"_id": 0})
+    if wall is None and wall_id == DEFAULT_WALL_ID:
+        # Startup could not reach Mongo to create it
+        await ensure_default_wall()
+        wall = await walls_collection.find_one({"id": wall_id}, {"_id": 0})
+    if wall is None:
+        return None
+    wall_cache.set(wall_id, wall)
+    return wall
+
+async def current_wall(request: Request) -> dict:
+    # The legacy /api/items routes have no wall_id and address the default wall
+    wall_id = request.path_params.get("wall_id", DEFAULT_WALL_ID)
+    wall = await load_wall(wall_id)
+    if wall is None:
+        raise HTTPException(status_code=404, detail="Wall not found")
+    return wall
+
+async def reserve_wall_items(wall_id: str, count: int) -> bool:
+    # Room for `count` more items, taken atomically; False when the wall is full
+    if count <= 0:
+        return True
+    result = await walls_collection.update_one(
+        {"id": wall_id, "$expr": {"$lte": [{"$add": ["$item_count", count]}, "$item_quota"]}},
+        {"$inc": {"item_count": count}},
+    )
+    return result.modified_count == 1
+
+async def release_wall_items(wall_id: str, count: int):
+    # For deleted items and for reservations whose writes failed
+    if count > 0:
+        await walls_collection.update_one({"id": wall_id}, {"$inc": {"item_count": -count}})
+
+# Storage
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+UPLOADS_DIR = Path(os.environ.get('UPLOADS_DIR', '/app/backend/uploads'))
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_PREFIX = os.environ.get('S3_PREFIX', 'uploads/')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. a local MinIO
+S3_REGION = os.environ.get('S3_REGION')
+S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+
+def unlink_paths(paths: List[Path]):
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+class LocalStorage:
+    # Files under a local directory, served by this process
+    supports_direct_upload = False
+    
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Stage next to the final location so storing a file is a rename
+        self.staging_dir = root
+    
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Key outside storage root: {key}")
+        return path
+    
+    async def exists(self, key: str) -> bool:
+        return self.path(key).is_file()
+    
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            return (await run_in_threadpool(self.path(key).stat)).st_size
+        except (OSError, ValueError):
+            return None
+    
+    async def put_file(self, key: str, source: Path):
+        target = self.path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, target)
+    
+    async def read_chunks(self, key: str):
+        with self.path(key).open("rb") as f:
+            while chunk := await run_in_threadpool(f.read, UPLOAD_CHUNK_SIZE):
+                yield chunk
+    
+    async def delete(self, keys: List[str]):
+        await run_in_threadpool(unlink_paths, [self.path(key) for key in keys])
+    
+    async def list_stale(self, cutoff: float) -> List[str]:
+        def scan():
+            return [
+                str(path.relative_to(self.root)) for path in self.root.glob("??/??/*")
+                if path.stat().st_mtime < cutoff
+            ]
+        return await run_in_threadpool(scan)
+    
+    async def serve(self, key: str, request: Request) -> Response:
+        try:
+            path = self.path(key)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Not found")
+        if not path.is_file():
+            raise HTTPException(status_code=404, detail="Not found")
+        
+        stat = path.stat()
+        etag = f'"{path.name}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Cache-Control": UPLOAD_CACHE_CONTROL,
+            "Accept-Ranges": "bytes",
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(headers)
+        
+        # If-Range with a stale validator means the client wants the whole file
+        if_range = request.headers.get("if-range")
+        byte_range = None
+        if not if_range or if_range == etag:
+            byte_range = parse_byte_range(request.headers.get("range"), stat.st_size)
+        if byte_range is None:
+            return FileResponse(path, headers=headers)
+        
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iterate_in_threadpool(read_file_range(path, start, end)),
+            status_code=206,
+            media_type=mimetypes.guess_type(path.name)[0],
+            headers=headers,
+        )
+
+class S3Storage:
+    # Any S3-compatible object store (AWS, MinIO). Browsers fetch and upload
+    # objects directly through presigned URLs instead of through this process.
+    supports_direct_upload = True
+    
+    def __init__(self, bucket: str, prefix: str, endpoint_url: Optional[str] = None, region: Optional[str] = None):
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.staging_dir = Path(tempfile.gettempdir())
+    
+    def object_key(self, key: str) -> str:
+        return self.prefix + key
+    
+    async def exists(self, key: str) -> bool:
+        try:
+            await run_in_threadpool(self.s3.head_object, Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+    
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            head = await run_in_threadpool(self.s3.head_object, Bucket=self.bucket, Key=self.object_key(key))
+            return head["ContentLength"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+    
+    async def put_file(self, key: str, source: Path):
+        extra_args = {
+            "ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream",
+            "CacheControl": "public, max-age=31536000, immutable",
+        }
+        await run_in_threadpool(
+            self.s3.upload_file, str(source), self.bucket, self.object_key(key), ExtraArgs=extra_args
+        )
+        source.unlink(missing_ok=True)
+    
+    async def read_chunks(self, key: str):
+        obj = await run_in_threadpool(self.s3.get_object, Bucket=self.bucket, Key=self.object_key(key))
+        body = obj["Body"]
+        try:
+            while chunk := await run_in_threadpool(body.read, UPLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+    
+    async def delete(self, keys: List[str]):
+        # DeleteObjects takes at most 1000 keys per call
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": self.object_key(key)} for key in keys[start:start + 1000]]
+            await run_in_threadpool(
+                self.s3.delete_objects, Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+            )
+    
+    async def list_stale(self, cutoff: float) -> List[str]:
+        def scan():
+            stale = []
+            for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+                for obj in page.get("Contents", []):
+                    if obj["LastModified"].timestamp() < cutoff:
+                        stale.append(obj["Key"][len(self.prefix):])
+            return stale
+        return await run_in_threadpool(scan)
+    
+    def presign_put(self, key: str, content_type: str) -> str:
+        return self.s3.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key), "ContentType": content_type},
+            ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+    
+    def presign_get(self, key: str) -> str:
+        return self.s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key)},
+            ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+    
+    async def serve(self, key: str, request: Request) -> Response:
+        # Signing is local computation; the bytes never pass through us. The
+        # objects themselves carry immutable Cache-Control and S3 handles ranges.
+        # Letting the browser reuse the redirect for a while avoids a round trip.
+        return RedirectResponse(
+            self.presign_get(key),
+            status_code=307,
+            headers={"Cache-Control": f"private, max-age={S3_PRESIGN_EXPIRES // 2}"},
+        )
+
+if STORAGE_BACKEND == 's3':
+    storage = S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+else:
+    storage = LocalStorage(UPLOADS_DIR)
+
+# Image Processing
+IMAGE_VARIANTS = {"thumb": 320, "medium": 1280}  # longest side in pixels
+IMAGE_WEBP_QUALITY = int(os.environ.get('IMAGE_WEBP_QUALITY', 80))
+IMAGE_PLACEHOLDER_SIZE = 16
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+# Decoding and resizing is CPU-bound and holds the GIL, so it runs in
+# separate processes rather than on the event loop or its threadpool
+image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+
+def webp_ready(img: Image.Image) -> Image.Image:
+    if img.mode in ("RGB", "RGBA"):
+        return img
+    has_alpha = img.mode in ("LA", "PA") or "transparency" in img.info
+    return img.convert("RGBA" if has_alpha else "RGB")
+
+def process_image(path: str) -> dict:
+    # Runs in an image_pool worker; writes variants next to the original
+    source = Path(path)
+    with Image.open(source) as original:
+        original.load()
+        img = ImageOps.exif_transpose(original)
+        
+        # Rewrite the original without EXIF (GPS, device info); orientation
+        # has already been baked into the pixels above
+        if original.getexif():
+            img.save(source, format=original.format, quality=90)
+        
+        width, height = img.size
+        img = webp_ready(img)
+        
+        variants = {}
+        for name, max_side in IMAGE_VARIANTS.items():
+            variant = img.copy()
+            variant.thumbnail((max_side, max_side), Image.LANCZOS)
+            variant_name = f"{source.stem}_{name}.webp"
+            variant.save(source.parent / variant_name, format="WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+            variants[name] = variant_name
+        
+        # Tiny inline preview shown while the real image loads
+        lqip = img.copy()
+        lqip.thumbnail((IMAGE_PLACEHOLDER_SIZE, IMAGE_PLACEHOLDER_SIZE))
+        buffer = io.BytesIO()
+        lqip.save(buffer, format="WEBP", quality=30)
+    
+    return {
+        "width": width,
+        "height": height,
+        "placeholder": "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode(),
+        "variants": variants,
+    }
+
+# Magic bytes of the formats the image pipeline accepts
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+# Browser-declared types accepted for direct uploads; the bytes are still sniffed afterwards
+IMAGE_CONTENT_TYPES = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif", "image/webp": "webp"}
+
+def legacy_upload_keys(item: dict) -> List[str]:
+    urls = [item.get("image_url"), *(item.get("variants") or {}).values()]
+    return [url.split("/")[-1] for url in urls if url]
+
+# Blob Store
+# Uploads are stored once per distinct content, keyed by SHA-256 and sharded
+# two levels deep (ab/cd/abcd...png). Items hold counted references in the
+# blobs collection and a blob is removed together with its last item.
+BLOB_GC_INTERVAL_SECONDS = int(os.environ.get('BLOB_GC_INTERVAL_SECONDS', 3600))
+BLOB_GC_GRACE_SECONDS = int(os.environ.get('BLOB_GC_GRACE_SECONDS', 86400))
+BLOB_URL_PATTERN = re.compile(r"^/api/uploads/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.[a-z]+$")
+
+def blob_relpath(digest: str, name: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+def blob_key_from_url(url: Optional[str]) -> Optional[str]:
+    match = BLOB_URL_PATTERN.match(url or "")
+    return match.group(1) if match else None
+
+def blob_keys(blob: dict) -> List[str]:
+    names = [f"{blob['_id']}.{blob['ext']}", *(blob.get("variants") or {}).values()]
+    return [blob_relpath(blob["_id"], name) for name in names]
+
+def blob_response(blob: dict) -> dict:
+    filename = blob_relpath(blob["_id"], f"{blob['_id']}.{blob['ext']}")
+    return {
+        "filename": filename,
+        "url": f"/api/uploads/{filename}",
+        "width": blob.get("width"),
+        "height": blob.get("height"),
+        "placeholder": blob.get("placeholder"),
+        "variants": {
+            name: f"/api/uploads/{blob_relpath(blob['_id'], variant)}"
+            for name, variant in (blob.get("variants") or {}).items()
+        },
+    }
+
+async def acquire_blob(digest: str, count: int = 1) -> Optional[dict]:
+    return await blobs_collection.find_one_and_update(
+        {"_id": digest},
+        {"$inc": {"refs": count}, "$set": {"updated_at": datetime.utcnow().isoformat()}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def release_blob(digest: str, count: int = 1):
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": digest},
+        {"$inc": {"refs": -count}, "$set": {"updated_at": datetime.utcnow().isoformat()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if blob and blob["refs"] <= 0:
+        # Conditional delete so a reference taken in the meantime keeps the blob alive
+        removed = await blobs_collection.find_one_and_delete({"_id": digest, "refs": {"$lte": 0}})
+        if removed:
+            await storage.delete(blob_keys(removed))
+
+def remove_stale_staging(cutoff: float) -> int:
+    stale = [path for path in storage.staging_dir.glob(".upload-*") if path.stat().st_mtime < cutoff]
+    for path in stale:
+        shutil.rmtree(path, ignore_errors=True)
+    return len(stale)
+
+async def collect_garbage_blobs() -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=BLOB_GC_GRACE_SECONDS)
+    removed = 0
+    
+    # Uploaded but never attached to an item, or left at zero by a crash
+    stale_blobs = blobs_collection.find({"refs": {"$lte": 0}, "updated_at": {"$lt": cutoff.isoformat()}})
+    async for blob in stale_blobs:
+        if await blobs_collection.find_one_and_delete({"_id": blob["_id"], "refs": {"$lte": 0}}):
+            await storage.delete(blob_keys(blob))
+            removed += 1
+    
+    # Objects with no blob record: abandoned direct uploads and lost deletes
+    keys = await storage.list_stale(cutoff.timestamp())
+    by_digest = {}
+    for key in keys:
+        by_digest.setdefault(key.split("/")[-1][:64], []).append(key)
+    digests = list(by_digest)
+    for start in range(0, len(digests), 500):
+        batch = digests[start:start + 500]
+        known = {blob["_id"] async for blob in blobs_collection.find({"_id": {"$in": batch}}, {"_id": 1})}
+        orphans = [key for digest in batch if digest not in known for key in by_digest[digest]]
+        await storage.delete(orphans)
+        removed += len(orphans)
+    
+    # Staging directories left behind by interrupted uploads
+    removed += await run_in_threadpool(remove_stale_staging, cutoff.timestamp())
+    
+    return removed
+
+async def ingest_upload(chunks) -> dict:
+    # Stream into a private staging directory with disk writes on the
+    # threadpool, then process and hand the files to storage
+    global upload_bytes_received
+    workdir = Path(await run_in_threadpool(tempfile.mkdtemp, prefix=".upload-", dir=storage.staging_dir))
+    staged = workdir / "upload.part"
+    file_ext = None
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with staged.open("wb") as buffer:
+            async for chunk in chunks:
+                if file_ext is None:
+                    # Trust the bytes, not the client's content type or filename
+                    file_ext = sniff_image_type(chunk)
+                    if file_ext is None:
+                        raise HTTPException(status_code=400, detail="File must be an image")
+                size += len(chunk)
+                upload_bytes_received += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+                digest.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+        
+        if file_ext is None:
+            raise HTTPException(status_code=400, detail="File must be an image")
+        
+        key = digest.hexdigest()
+        original = f"{key}.{file_ext}"
+        
+        # Same bytes already stored: nothing to write or process. Touching
+        # updated_at keeps the GC grace period from expiring under the client.
+        blob = await blobs_collection.find_one_and_update(
+            {"_id": key},
+            {"$set": {"updated_at": datetime.utcnow().isoformat()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if blob and await storage.exists(blob_relpath(key, original)):
+            upload_results["deduplicated"] += 1
+            return blob_response(blob)
+        
+        source = workdir / original
+        os.replace(staged, source)
+        try:
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(image_pool, process_image, str(source))
+        except Exception:
+            raise HTTPException(status_code=400, detail="File must be an image")
+        
+        # Variants first, so a stored original always has its variants
+        for variant in image["variants"].values():
+            await storage.put_file(blob_relpath(key, variant), workdir / variant)
+        await storage.put_file(blob_relpath(key, original), source)
+    except HTTPException:
+        upload_results["rejected"] += 1
+        raise
+    finally:
+        await run_in_threadpool(shutil.rmtree, workdir, True)
+    
+    now = datetime.utcnow().isoformat()
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": key},
+        {
+            "$set": {"ext": file_ext, "size": size, "updated_at": now, **image},
+            "$setOnInsert": {"refs": 0, "created_at": now},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    upload_results["stored"] += 1
+    return blob_response(blob)
 
-# Mount static files under /api prefix for Kubernetes ingress
-app.mount("/api/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+async def blob_gc_loop():
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        try:
+            removed = await collect_garbage_blobs()
+            if removed:
+                logger.info("Blob garbage collection removed %d entries", removed)
+        except Exception as e:
+            logger.warning("Blob garbage collection failed: %s", e)
 
 # Pydantic Models
 class UserRegister(BaseModel):
@@ -68,22 +2601,48 @@ class WallItem(BaseModel):
     content: Optional[str] = None  # For sticky notes
     image_url: Optional[str] = None  # For images
     caption: Optional[str] = None
-    position: dict  # {x: int, y: int, gridColumn: int, gridRow: int}
+    position: Optional[dict] = None  # {x: int, y: int, gridColumn: int, gridRow: int}; omit to auto-place
     background_color: Optional[str] = None  # For sticky notes
     created_at: Optional[str] = None
     created_by: Optional[str] = None
+    width: Optional[int] = None  # For images, from the upload response
+    height: Optional[int] = None
+    placeholder: Optional[str] = None  # Inline low-quality preview
+    variants: Optional[dict] = None  # {thumb: url, medium: url}
+
+class DirectUploadRequest(BaseModel):
+    content_type: str
+    size: int
+
+class DirectUploadComplete(BaseModel):
+    upload_id: str
 
 class ItemUpdate(BaseModel):
     caption: Optional[str] = None
     position: Optional[dict] = None
     content: Optional[str] = None
+    revision: Optional[int] = None  # The revision the change is based on; stale ones get 409
+    final: Optional[bool] = None  # End of a drag: write buffered positions now
+
+class BatchOperation(BaseModel):
+    op: str  # "create", "update" or "delete"
+    id: Optional[str] = None  # For update and delete
+    item: Optional[WallItem] = None  # For create
+    changes: Optional[ItemUpdate] = None  # For update
+
+class ItemBatch(BaseModel):
+    operations: List[BatchOperation]
+
+class WallCreate(BaseModel):
+    name: str
 
 # Helper Functions
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def verify_password(plain_password: str, hashed_password: str):
+    # Returns (valid, new_hash); new_hash is set when the stored hash is outdated
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -95,23 +2654,49 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def token_payload(token: str) -> Optional[dict]:
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        except JWTError:
+            return None
+        # Never keep a token cached past its own expiry
+        ttl = AUTH_TOKEN_CACHE_TTL
+        if payload.get("exp"):
+            ttl = min(ttl, payload["exp"] - time.time())
+        token_cache.set(token, payload, ttl)
+    return payload
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if not credentials:
         return None
     
-    token = credentials.credentials
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        user = users_collection.find_one({"email": email}, {"_id": 0, "password": 0})
-        return user
-    except JWTError:
+    payload = token_payload(credentials.credentials)
+    if payload is None:
+        return None
+    
+    email: str = payload.get("sub")
+    if email is None:
         return None
+    return await load_user(email)
 
-def require_auth(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    user = get_current_user(credentials)
+def encode_cursor(item: dict) -> str:
+    raw = json.dumps([item["created_at"], item["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(created_at, str) or not isinstance(item_id, str):
+            raise ValueError(cursor)
+        return created_at, item_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def require_auth(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    user = await get_current_user(credentials)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -120,30 +2705,594 @@ def require_auth(credentials: HTTPAuthorizationCredentials = Depends(security)):
         )
     return user
 
+def new_item_document(item: WallItem, user: dict, wall_id: str) -> dict:
+    item_dict = item.dict()
+    item_dict["id"] = str(uuid.uuid4())
+    item_dict["wall_id"] = wall_id
+    item_dict["revision"] = 0
+    item_dict["created_at"] = datetime.utcnow().isoformat()
+    item_dict["created_by"] = user["id"]
+    return item_dict
+
+async def wall_grid(wall_id: str) -> SpatialGrid:
+    # The loaded snapshot's grid, or one built from the wall's positions
+    snapshot = wall_snapshots.ready(wall_id) if WALL_SNAPSHOT else None
+    if snapshot:
+        return snapshot.grid
+    grid = SpatialGrid()
+    async for item in items_collection.find({"wall_id": wall_id, **LIVE_ITEMS}, PLACEMENT_FIELDS):
+        grid.put(item["id"], item)
+    return grid
+
+def place_item(grid: SpatialGrid, item_dict: dict):
+    item_dict["position"] = slot_position(*grid.free_slot(item_footprint(item_dict)))
+    # Hold the slot until the item's own event lands, so concurrent creates
+    # on this worker pick different slots
+    grid.put(item_dict["id"], item_dict)
+
+def attach_blob(item_dict: dict, blob: dict):
+    # The item holds a reference on the uploaded blob; its stored metadata is authoritative
+    stored = blob_response(blob)
+    item_dict["blob"] = blob["_id"]
+    for field in ("width", "height", "placeholder", "variants"):
+        item_dict[field] = stored[field]
+
+def item_changes(update_data: ItemUpdate) -> dict:
+    fields = update_data.dict(exclude={"revision", "final"})
+    return {k: v for k, v in fields.items() if v is not None}
+
+def tombstone_update(version: int) -> dict:
+    # Leave a tombstone carrying a fresh version for delta sync
+    return {
+        "$set": {
+            "deleted": True,
+            "deleted_at": datetime.utcnow().isoformat(),
+            "version": version,
+        },
+        "$unset": {"content": "", "image_url": "", "caption": "", "placeholder": "", "variants": "", "blob": ""},
+    }
+
+async def release_item_uploads(items: List[dict]):
+    blob_refs = Counter(item["blob"] for item in items if item.get("blob"))
+    for digest, count in blob_refs.items():
+        await release_blob(digest, count)
+    # Uploads from before the blob store belong to their item alone
+    legacy_keys = [key for item in items if not item.get("blob") for key in legacy_upload_keys(item)]
+    if legacy_keys:
+        await storage.delete(legacy_keys)
+
+def batch_operation_error(operation: BatchOperation) -> Optional[str]:
+    if operation.op == "create":
+        return None if operation.item else "create needs an item"
+    if operation.op not in ("update", "delete"):
+        return f"Unknown operation: {operation.op}"
+    if not operation.id:
+        return f"{operation.op} needs an id"
+    if operation.op == "update" and not (operation.changes and item_changes(operation.changes)):
+        return "No valid fields to update"
+    return None
+
+# Wall Archives
+# A wall moves as one uncompressed tar (images are compressed already):
+#   wall.json                      format version and wall name
+#   blobs/<digest>.json            blob metadata, followed by its original
+#   uploads/ab/cd/<file>           the original; variants are made again on import
+#   uploads/<file>                 uploads from before the blob store
+#   items/<n>.ndjson               up to ARCHIVE_ITEMS_PER_FILE items
+# Each items file comes after every file its items reference, so both ends
+# work through the archive in one pass with memory bounded by a page of items.
+ARCHIVE_FORMAT = 1
+ARCHIVE_ITEMS_PER_FILE = int(os.environ.get('ARCHIVE_ITEMS_PER_FILE', 1000))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', 20 * 1024 ** 3))
+ARCHIVE_MAX_METADATA_BYTES = 1024 * 1024  # wall.json, blob metadata, one item line
+TAR_BLOCK = 512
+
+# Archived item fields that are regenerated on import
+ARCHIVE_INTERNAL_FIELDS = ("wall_id", "version", "revision", "blob")
+
+def tar_header(name: str, size: int) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.USTAR_FORMAT)
+
+def tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % TAR_BLOCK)
+
+def tar_member(name: str, data: bytes) -> bytes:
+    return tar_header(name, len(data)) + data + tar_padding(len(data))
+
+async def export_file(key: str, name: str):
+    size = await storage.size(key)
+    if size is None:
+        logger.warning("Export skipped missing upload %s", key)
+        return
+    yield tar_header(name, size)
+    sent = 0
+    async for chunk in storage.read_chunks(key):
+        sent += len(chunk)
+        yield chunk
+    if sent != size:
+        # The header promised `size` bytes; better a broken download than a wrong archive
+        raise RuntimeError(f"Upload {key} changed size during export")
+    yield tar_padding(size)
+
+async def export_items_file(items: List[dict], number: int, exported: set):
+    digests = [digest for digest in dict.fromkeys(item.get("blob") for item in items) if digest and digest not in exported]
+    async for blob in blobs_collection.find({"_id": {"$in": digests}}):
+        metadata = {k: v for k, v in blob.items() if k not in ("refs", "created_at", "updated_at")}
+        yield tar_member(f"blobs/{blob['_id']}.json", dumps_json(metadata))
+        original = blob_keys(blob)[0]
+        async for chunk in export_file(original, f"uploads/{original}"):
+            yield chunk
+        exported.add(blob["_id"])
+    
+    for item in items:
+        url = item.get("image_url") or ""
+        legacy = url.startswith("/api/uploads/") and not item.get("blob") and url.split("/")[-1]
+        if legacy and legacy not in exported:
+            async for chunk in export_file(legacy, f"uploads/{legacy}"):
+                yield chunk
+            exported.add(legacy)
+    
+    lines = [dumps_json({k: v for k, v in item.items() if k not in ARCHIVE_INTERNAL_FIELDS}) for item in items]
+    yield tar_member(f"items/{number:05d}.ndjson", b"\n".join(lines) + b"\n")
+
+async def export_archive(wall: dict):
+    wall_id = wall["id"]
+    manifest = {
+        "format": ARCHIVE_FORMAT,
+        "wall": {"name": wall.get("name")},
+        "version": await current_items_version(wall_id),
+        "exported_at": datetime.utcnow().isoformat(),
+    }
+    yield tar_member("wall.json", dumps_json(manifest))
+    
+    # Keyset pages rather than one long cursor, which would time out
+    # behind a slow download
+    exported = set()
+    query = {"wall_id": wall_id, **LIVE_ITEMS}
+    number = 0
+    while True:
+        items = await items_collection.find(query, {"_id": 0}).sort(ITEMS_LIST_INDEX).limit(ARCHIVE_ITEMS_PER_FILE).to_list(length=None)
+        if not items:
+            break
+        async for chunk in export_items_file(items, number, exported):
+            yield chunk
+        number += 1
+        last = items[-1]
+        query = {"wall_id": wall_id, **LIVE_ITEMS, "$or": [
+            {"created_at": {"$gt": last["created_at"]}},
+            {"created_at": last["created_at"], "id": {"$gt": last["id"]}},
+        ]}
+    yield b"\0" * (2 * TAR_BLOCK)
+
+class TarStream:
+    # Reads a tar archive member by member from an async stream of chunks
+    def __init__(self, chunks, max_bytes: int):
+        self.chunks = chunks.__aiter__()
+        self.max_bytes = max_bytes
+        self.buffer = bytearray()
+        self.received = 0
+    
+    async def fill(self) -> bool:
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            return False
+        self.received += len(chunk)
+        if self.received > self.max_bytes:
+            raise HTTPException(status_code=413, detail="Archive too large")
+        self.buffer += chunk
+        return True
+    
+    async def read(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            if not await self.fill():
+                raise HTTPException(status_code=400, detail="Truncated archive")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+    
+    async def body(self, size: int):
+        remaining = size
+        while remaining:
+            if not self.buffer and not await self.fill():
+                raise HTTPException(status_code=400, detail="Truncated archive")
+            chunk = bytes(self.buffer[:min(remaining, UPLOAD_CHUNK_SIZE)])
+            del self.buffer[:len(chunk)]
+            remaining -= len(chunk)
+            yield chunk
+    
+    async def members(self):
+        # Yields (name, size, body). Whatever of a body the caller leaves
+        # unread is skipped before the next member.
+        long_name = None
+        while True:
+            block = await self.read(TAR_BLOCK)
+            if not block.strip(b"\0"):
+                return
+            try:
+                info = tarfile.TarInfo.frombuf(block, "utf-8", "surrogateescape")
+            except tarfile.HeaderError:
+                raise HTTPException(status_code=400, detail="Invalid archive")
+            padding = -info.size % TAR_BLOCK
+            if info.type in (tarfile.XHDTYPE, tarfile.XGLTYPE):
+                # pax extended header: only a long path matters here
+                if info.size > ARCHIVE_MAX_METADATA_BYTES:
+                    raise HTTPException(status_code=400, detail="Invalid archive")
+                for record in (await self.read(info.size + padding)).split(b"\n"):
+                    key, _, value = record.partition(b" ")[2].partition(b"=")
+                    if key == b"path" and info.type == tarfile.XHDTYPE:
+                        long_name = value.decode("utf-8", "replace")
+                continue
+            name, long_name = long_name or info.name, None
+            body = self.body(info.size if info.isreg() else 0)
+            if info.isreg():
+                yield name, info.size, body
+            async for _ in body:
+                pass
+            await self.read(padding)
+
+async def read_member(body, size: int) -> bytes:
+    if size > ARCHIVE_MAX_METADATA_BYTES:
+        raise HTTPException(status_code=400, detail="Archive metadata too large")
+    return b"".join([chunk async for chunk in body])
+
+async def member_lines(body):
+    pending = bytearray()
+    async for chunk in body:
+        pending += chunk
+        *lines, rest = pending.split(b"\n")
+        if len(rest) > ARCHIVE_MAX_METADATA_BYTES:
+            raise HTTPException(status_code=400, detail="Archive line too long")
+        pending = bytearray(rest)
+        for line in lines:
+            yield bytes(line)
+    yield bytes(pending)
+
+class WallImport:
+    def __init__(self, wall_id: str, user: dict):
+        self.wall_id = wall_id
+        self.user = user
+        self.uploads = {}  # digest or legacy file name in the archive -> digest stored here
+        self.blob = None  # digest and type of the blob whose original comes next
+        self.pending = []  # (item document, digest) waiting for a bulk insert
+        self.counts = Counter()  # items, skipped_items, blobs_stored, blobs_existing, skipped_files
+    
+    async def add(self, name: str, size: int, body):
+        if name == "wall.json":
+            manifest = json.loads(await read_member(body, size))
+            if not isinstance(manifest, dict):
+                raise ValueError("wall.json is not an object")
+            if manifest.get("format") != ARCHIVE_FORMAT:
+                raise HTTPException(status_code=400, detail="Unsupported archive format")
+        elif name.startswith("blobs/") and name.endswith(".json"):
+            data = await read_member(body, size)
+            try:
+                metadata = json.loads(data)
+            except ValueError:
+                metadata = None
+            if isinstance(metadata, dict):
+                await self.start_blob(metadata)
+            else:
+                # Its original, should one follow, is skipped with it
+                self.blob = None
+                self.counts["skipped_files"] += 1
+        elif name.startswith("uploads/"):
+            await self.add_upload(name[len("uploads/"):], body)
+        elif name.startswith("items/") and name.endswith(".ndjson"):
+            async for line in member_lines(body):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    data = None
+                if isinstance(data, dict):
+                    await self.add_item(data)
+                else:
+                    self.counts["skipped_items"] += 1
+        else:
+            self.counts["skipped_files"] += 1
+    
+    async def start_blob(self, metadata: dict):
+        digest, ext = metadata.get("_id"), metadata.get("ext")
+        self.blob = None
+        if not isinstance(digest, str) or not re.fullmatch(r"[0-9a-f]{64}", digest) or ext not in ("png", "jpg", "gif", "webp"):
+            return
+        # Already stored here (a clone within one deployment): the file can be skipped
+        existing = await blobs_collection.find_one({"_id": digest})
+        if existing and await storage.exists(blob_keys(existing)[0]):
+            self.uploads[digest] = digest
+            self.counts["blobs_existing"] += 1
+            return
+        self.blob = {"_id": digest, "ext": ext}
+    
+    async def add_upload(self, key: str, body):
+        # Only originals are taken from the archive. They go through the
+        # upload pipeline like any upload, which checks and processes the
+        # bytes and derives the variants and metadata itself.
+        name = key.split("/")[-1]
+        if "/" in key:
+            blob = self.blob
+            if blob is None or key != blob_relpath(blob["_id"], f"{blob['_id']}.{blob['ext']}"):
+                # Variants are made again; anything else does not belong here
+                if name[:64] not in self.uploads and not (blob and name.startswith(blob["_id"])):
+                    self.counts["skipped_files"] += 1
+                return
+            self.blob = None
+            reference = blob["_id"]
+        else:
+            # Uploaded before the blob store; items refer to it by file name
+            reference = key
+        try:
+            stored = await ingest_upload(body)
+        except HTTPException:
+            self.counts["skipped_files"] += 1
+            return
+        self.uploads[reference] = blob_key_from_url(stored["url"])
+        self.counts["blobs_stored"] += 1
+    
+    async def add_item(self, data: dict):
+        try:
+            item = WallItem(**{k: v for k, v in data.items() if k in WallItem.__fields__})
+        except ValueError:
+            self.counts["skipped_items"] += 1
+            return
+        document = new_item_document(item, self.user, self.wall_id)
+        if isinstance(data.get("created_at"), str):
+            document["created_at"] = data["created_at"]
+        
+        digest = None
+        url = document.get("image_url")
+        if url and url.startswith("/api/uploads/"):
+            digest = self.uploads.get(blob_key_from_url(url) or url.split("/")[-1])
+            if digest is None:
+                # Its image was not in the archive
+                self.counts["skipped_items"] += 1
+                return
+        self.pending.append((document, digest))
+        if len(self.pending) >= IMPORT_BATCH_SIZE:
+            await self.flush()
+    
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        if not await reserve_wall_items(self.wall_id, len(batch)):
+            raise HTTPException(status_code=403, detail=f"This wall is full after importing {self.counts['items']} items")
+        
+        blobs = {}
+        for digest, count in Counter(digest for _, digest in batch if digest).items():
+            blob = await acquire_blob(digest, count)
+            if blob:
+                blobs[digest] = blob
+        documents = []
+        for document, digest in batch:
+            if digest:
+                if digest not in blobs:
+                    self.counts["skipped_items"] += 1
+                    continue
+                attach_blob(document, blobs[digest])
+                document["image_url"] = blob_response(blobs[digest])["url"]
+            documents.append(document)
+        await release_wall_items(self.wall_id, len(batch) - len(documents))
+        if not documents:
+            return
+        
+        for document, version in zip(documents, await next_items_versions(self.wall_id, len(documents))):
+            document["version"] = version
+        failed = set()
+        try:
+            await items_collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details["writeErrors"]}
+            await release_wall_items(self.wall_id, len(failed))
+            await release_item_uploads([documents[index] for index in failed])
+        await items_written(self.wall_id)
+        for index, document in enumerate(documents):
+            if index in failed:
+                self.counts["skipped_items"] += 1
+                continue
+            self.counts["items"] += 1
+            await publish_item_event("created", {k: v for k, v in document.items() if k != "_id"})
+
+# Metrics Exposition
+READY_MONGO_TIMEOUT_SECONDS = float(os.environ.get('READY_MONGO_TIMEOUT_SECONDS', 2))
+READY_MIN_FREE_BYTES = int(os.environ.get('READY_MIN_FREE_BYTES', 512 * 1024 * 1024))
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items()) + "}"
+
+class MetricsWriter:
+    # Prometheus text exposition format 0.0.4
+    def __init__(self):
+        self.lines = []
+    
+    def header(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+    
+    def metric(self, name: str, kind: str, help_text: str, samples):
+        self.header(name, kind, help_text)
+        for labels, value in samples:
+            self.lines.append(f"{name}{format_labels(labels)} {value}")
+    
+    def histogram(self, name: str, help_text: str, series):
+        self.header(name, "histogram", help_text)
+        for labels, latency in series:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, latency.buckets):
+                cumulative += count
+                self.lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {cumulative}")
+            self.lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {latency.count}")
+            self.lines.append(f"{name}_sum{format_labels(labels)} {latency.total}")
+            self.lines.append(f"{name}_count{format_labels(labels)} {latency.count}")
+    
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+def render_metrics() -> str:
+    out = MetricsWriter()
+    out.histogram(
+        "wall_http_request_duration_seconds", "Request latency by route template",
+        [({"method": method, "route": route}, latency) for (method, route), latency in sorted(route_latency.items())],
+    )
+    out.metric(
+        "wall_http_responses_total", "counter", "Responses by route template and status",
+        [({"method": m, "route": r, "status": code}, n) for (m, r, code), n in sorted(route_responses.items())],
+    )
+    out.metric("wall_http_requests_in_flight", "gauge", "Requests currently being handled", [({}, requests_in_flight)])
+    out.metric("wall_event_subscribers", "gauge", "Open event streams", [({}, events_hub.count())])
+    
+    out.metric("wall_upload_received_bytes_total", "counter", "Upload bytes received", [({}, upload_bytes_received)])
+    out.metric(
+        "wall_uploads_total", "counter", "Uploads by outcome",
+        [({"result": result}, n) for result, n in sorted(upload_results.items())],
+    )
+    
+    with mongo_timer.lock:
+        mongo_latency = sorted(mongo_timer.latency.items())
+        mongo_failures = sorted(mongo_timer.failures.items())
+    out.histogram(
+        "wall_mongo_command_duration_seconds", "MongoDB command latency by command",
+        [({"command": command}, latency) for command, latency in mongo_latency],
+    )
+    out.metric(
+        "wall_mongo_command_failures_total", "counter", "Failed MongoDB commands by command",
+        [({"command": command}, n) for command, n in mongo_failures],
+    )
+    
+    caches = auth_cache_stats()
+    out.metric("wall_cache_hits_total", "counter", "Auth cache hits", [({"cache": name}, c["hits"]) for name, c in caches.items()])
+    out.metric("wall_cache_misses_total", "counter", "Auth cache misses", [({"cache": name}, c["misses"]) for name, c in caches.items()])
+    out.metric(
+        "wall_cache_entries", "gauge", "Entries held in in-process caches",
+        [({"cache": name}, c["size"]) for name, c in caches.items() if "size" in c],
+    )
+    
+    out.metric("wall_password_pool_pending", "gauge", "Password hashes queued or running", [({}, password_pool.pending)])
+    out.metric("wall_password_pool_rejected_total", "counter", "Password hashes turned away", [({}, password_pool.rejected)])
+    out.histogram("wall_password_pool_wait_seconds", "Time password hashes spent queued", [({}, password_pool.wait)])
+    out.histogram("wall_password_pool_run_seconds", "Time spent hashing passwords", [({}, password_pool.run)])
+    
+    out.metric(
+        "wall_position_updates_total", "counter", "Position updates accepted into the buffer, written, and lost to conflicts",
+        [({"result": result}, n) for result, n in sorted(position_buffer.results.items())],
+    )
+    out.metric(
+        "wall_rate_limit_requests_total", "counter", "Rate-limited route requests let through or turned away",
+        [({"group": group, "result": result}, n) for (group, result), n in sorted(rate_limit_results.items())],
+    )
+    return out.render()
+
+async def readiness_checks() -> dict:
+    checks = {"setup": {"ok": database_setup["ready"], "attempts": database_setup["attempts"]}}
+    if database_setup["error"]:
+        checks["setup"]["error"] = database_setup["error"]
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), READY_MONGO_TIMEOUT_SECONDS)
+        checks["mongo"] = {"ok": True}
+    except Exception as e:
+        checks["mongo"] = {"ok": False, "error": str(e) or type(e).__name__}
+    
+    # Uploads stage on this disk whichever storage backend is in use
+    try:
+        usage = await run_in_threadpool(shutil.disk_usage, storage.staging_dir)
+        checks["disk"] = {"ok": usage.free >= READY_MIN_FREE_BYTES, "free_bytes": usage.free}
+    except OSError as e:
+        checks["disk"] = {"ok": False, "error": str(e)}
+    return checks
+
 # API Routes
 @app.get("/api/health")
-def health_check():
+async def health_check():
+    # Liveness only; /api/ready checks dependencies
     return {"status": "healthy"}
 
+@app.get("/api/ready")
+async def readiness_check():
+    checks = await readiness_checks()
+    ready = all(check["ok"] for check in checks.values())
+    return JSONResponse(
+        {"status": "ready" if ready else "unavailable", "checks": checks},
+        status_code=200 if ready else 503,
+    )
+
+async def require_profile_token(x_profile_token: Optional[str] = Header(None)):
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    if not x_profile_token or not hmac.compare_digest(x_profile_token, PROFILE_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_profile_token)])
+async def list_profiles():
+    return profiler.summaries()
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+async def get_profile(profile_id: str, format: str = Query("speedscope", pattern="^(speedscope|collapsed)$")):
+    profile = profiler.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    return profile.speedscope()
+
+@app.get("/api/metrics")
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats")
+async def get_stats():
+    return {
+        "auth_cache": auth_cache_stats(),
+        "password_pool": password_pool.stats(),
+        "position_buffer": position_buffer.stats(),
+        "rate_limits": {
+            **rate_limiter.stats(),
+            "groups": {f"{group} {result}": n for (group, result), n in sorted(rate_limit_results.items())},
+        },
+        "query_plans": query_plan_report,
+        "wall_snapshots": wall_snapshots.stats(),
+        "wall_cache": wall_cache.stats(),
+        "routes": {f"{method} {route}": latency.stats() for (method, route), latency in sorted(route_latency.items())},
+    }
+
 @app.post("/api/auth/register", response_model=Token)
-def register(user_data: UserRegister):
-    # Check if user exists
-    if users_collection.find_one({"email": user_data.email}):
+async def register(user_data: UserRegister):
+    if not database_setup["ready"]:
+        # Without the unique email index duplicates would get through
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is starting, please retry shortly",
+            headers={"Retry-After": str(math.ceil(SETUP_RETRY_SECONDS))},
         )
     
-    # Create user
+    # Create user; the unique email index rejects duplicates atomically
     user_id = str(uuid.uuid4())
     user = {
         "id": user_id,
         "email": user_data.email,
         "name": user_data.name,
-        "password": hash_password(user_data.password),
+        "password": await password_pool.submit(hash_password, user_data.password),
         "created_at": datetime.utcnow().isoformat()
     }
-    users_collection.insert_one(user)
+    try:
+        await users_collection.insert_one(user)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    await invalidate_user(user_data.email)
     
     # Create token
     access_token = create_access_token(data={"sub": user_data.email})
@@ -159,15 +3308,30 @@ def register(user_data: UserRegister):
     }
 
 @app.post("/api/auth/login", response_model=Token)
-def login(user_data: UserLogin):
-    user = users_collection.find_one({"email": user_data.email})
+async def login(user_data: UserLogin):
+    user = await users_collection.find_one({"email": user_data.email})
     
-    if not user or not verify_password(user_data.password, user["password"]):
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
+    # bcrypt is CPU-bound; keep it off the event loop
+    valid, new_hash = await password_pool.submit(verify_password, user_data.password, user["password"])
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password"
+        )
+    if new_hash:
+        # Cost parameters changed since this hash was made; only replace the
+        # hash we verified, in case a concurrent login already did
+        await users_collection.update_one(
+            {"email": user_data.email, "password": user["password"]},
+            {"$set": {"password": new_hash}},
+        )
+    
     access_token = create_access_token(data={"sub": user_data.email})
     
     return {
@@ -181,83 +3345,611 @@ def login(user_data: UserLogin):
     }
 
 @app.get("/api/auth/me")
-def get_me(user: dict = Depends(require_auth)):
+async def get_me(user: dict = Depends(require_auth)):
     return user
 
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...), user: dict = Depends(require_auth)):
-    # Validate file type
-    if not file.content_type.startswith('image/'):
+    async def chunks():
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+    
+    return await ingest_upload(chunks())
+
+@app.post("/api/uploads/presign")
+async def presign_upload(request: DirectUploadRequest, user: dict = Depends(require_auth)):
+    if not storage.supports_direct_upload:
+        raise HTTPException(status_code=501, detail="Direct uploads are not supported by this storage backend")
+    if request.content_type not in IMAGE_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail="File must be an image")
+    if request.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
     
-    # Generate unique filename
-    file_ext = file.filename.split('.')[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_ext}"
-    file_path = UPLOADS_DIR / unique_filename
+    # The browser PUTs to a scratch key; /complete verifies and files it
+    upload_id = str(uuid.uuid4())
+    return {
+        "upload_id": upload_id,
+        "url": storage.presign_put(f"incoming/{upload_id}", request.content_type),
+        "method": "PUT",
+        "headers": {"Content-Type": request.content_type},
+        "expires_in": S3_PRESIGN_EXPIRES,
+    }
+
+@app.post("/api/uploads/complete")
+async def complete_upload(request: DirectUploadComplete, user: dict = Depends(require_auth)):
+    if not storage.supports_direct_upload:
+        raise HTTPException(status_code=501, detail="Direct uploads are not supported by this storage backend")
+    try:
+        upload_id = str(uuid.UUID(request.upload_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid upload id")
     
-    # Save file
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    key = f"incoming/{upload_id}"
+    if not await storage.exists(key):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    try:
+        return await ingest_upload(storage.read_chunks(key))
+    finally:
+        await storage.delete([key])
+
+# Served under the /api prefix for Kubernetes ingress
+@app.get("/api/uploads/{key:path}")
+async def serve_upload(key: str, request: Request):
+    return await storage.serve(key, request)
+
+@app.post("/api/walls", status_code=201)
+async def create_wall(wall: WallCreate, user: dict = Depends(require_auth)):
+    wall_doc = {
+        "id": str(uuid.uuid4()),
+        "name": wall.name,
+        "created_by": user["id"],
+        "created_at": datetime.utcnow().isoformat(),
+        "item_quota": WALL_ITEM_QUOTA,
+        "item_count": 0,
+    }
+    await walls_collection.insert_one(wall_doc)
+    return wall_response(wall_doc)
+
+@app.get("/api/walls")
+async def list_walls(limit: int = Query(100, ge=1, le=ITEMS_PAGE_MAX)):
+    walls = await walls_collection.find({}, {"_id": 0}).sort("created_at", 1).limit(limit).to_list(length=None)
+    return FastJSONResponse(walls)
+
+@app.get("/api/walls/{wall_id}")
+async def get_wall(wall_id: str):
+    # Straight from the database so item_count is current
+    wall = await walls_collection.find_one({"id": wall_id}, {"_id": 0})
+    if wall is None:
+        raise HTTPException(status_code=404, detail="Wall not found")
+    return wall
+
+@app.get("/api/export")
+@app.get("/api/walls/{wall_id}/export")
+async def export_wall(wall: dict = Depends(current_wall), user: dict = Depends(require_auth)):
+    filename = f"wall-{wall['id']}-{datetime.utcnow():%Y%m%d%H%M%S}.tar"
+    return StreamingResponse(
+        export_archive(wall),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+
+@app.post("/api/import")
+@app.post("/api/walls/{wall_id}/import")
+async def import_wall(request: Request, wall: dict = Depends(current_wall), user: dict = Depends(require_auth)):
+    # Items get new ids on this wall; images go through the upload pipeline
+    archive = WallImport(wall["id"], user)
+    try:
+        async for name, size, body in TarStream(request.stream(), IMPORT_MAX_BYTES).members():
+            await archive.add(name, size, body)
+        await archive.flush()
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid archive")
     
     return {
-        "filename": unique_filename,
-        "url": f"/api/uploads/{unique_filename}"
+        "items": archive.counts["items"],
+        "skipped_items": archive.counts["skipped_items"],
+        "blobs_stored": archive.counts["blobs_stored"],
+        "blobs_existing": archive.counts["blobs_existing"],
+        "skipped_files": archive.counts["skipped_files"],
+        "version": await current_items_version(wall["id"]),
     }
 
 @app.get("/api/items")
-def get_items():
-    items = list(items_collection.find({}, {"_id": 0}).sort("created_at", 1))
-    return items
+@app.get("/api/walls/{wall_id}/items")
+async def get_items(
+    request: Request,
+    wall: dict = Depends(current_wall),
+    limit: Optional[int] = Query(None, ge=1, le=ITEMS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, pattern="^canvas$"),
+    x_min: Optional[float] = None,
+    x_max: Optional[float] = None,
+    y_min: Optional[float] = None,
+    y_max: Optional[float] = None,
+):
+    wall_id = wall["id"]
+    query_key = hashlib.sha1(repr(sorted(request.query_params.multi_items())).encode()).hexdigest()[:16]
+    for axis, low, high in (("x", x_min, x_max), ("y", y_min, y_max)):
+        if low is not None and high is not None and low > high:
+            raise HTTPException(status_code=400, detail=f"{axis}_min must not exceed {axis}_max")
+    
+    # The whole wall, or a fully bounded viewport of it, comes straight from
+    # memory when the wall's snapshot is loaded
+    bounds = (x_min, x_max, y_min, y_max)
+    windowed = any(bound is not None for bound in bounds)
+    in_memory = not (limit or cursor) and (not windowed or all(bound is not None for bound in bounds))
+    snapshot = wall_snapshots.ready(wall_id) if WALL_SNAPSHOT and in_memory else None
+    if snapshot and windowed:
+        headers = {"ETag": f'"{snapshot.etag(query_key)}"', "Cache-Control": "no-cache", "X-Items-Version": str(snapshot.version)}
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return not_modified(headers)
+        return Response(snapshot.within(fields or "full", *bounds), media_type="application/json", headers=headers)
+    if snapshot:
+        tag = snapshot.etag(query_key)
+        headers = {
+            "Cache-Control": "no-cache",
+            "X-Items-Version": str(snapshot.version),
+            "Last-Modified": formatdate(snapshot.updated_at, usegmt=True),
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("if-none-match"), f'"{tag}"'):
+            return not_modified({**headers, "ETag": f'"{tag}"'})
+        body, encoding = await snapshot.body(fields or "full", accepted_encoding(request.headers.get("accept-encoding")))
+        headers["ETag"] = coded_etag(f'"{tag}"', encoding) if encoding else f'"{tag}"'
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type="application/json", headers=headers)
+    
+    query = {"wall_id": wall_id, **LIVE_ITEMS}
+    
+    # Keyset pagination: everything strictly after (created_at, id) of the cursor
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": item_id}},
+        ]
+    
+    # Viewport window: only items whose position falls inside the rectangle
+    for axis, low, high in (("x", x_min, x_max), ("y", y_min, y_max)):
+        bounds = {}
+        if low is not None:
+            bounds["$gte"] = low
+        if high is not None:
+            bounds["$lte"] = high
+        if bounds:
+            query[f"position.{axis}"] = bounds
+    
+    # Read the version first so a client resuming delta sync from it can
+    # only see duplicates, never miss a change
+    counter = await items_counter(wall_id)
+    
+    # Every landed write moves the generation, so the counter plus query
+    # string is a strong validator and an unchanged wall costs one counter read
+    etag = f'"items-{items_validator(counter)}-{query_key}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Items-Version": str(counter["seq"])}
+    if counter.get("updated_at"):
+        cache_headers["Last-Modified"] = formatdate(counter["updated_at"].replace(tzinfo=timezone.utc).timestamp(), usegmt=True)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(cache_headers)
+    
+    projection = CANVAS_FIELDS if fields == "canvas" else {"_id": 0}
+    find = items_collection.find(query, projection).sort(ITEMS_LIST_INDEX)
+    if not limit:
+        # The whole wall: stream it rather than hold every item in memory
+        return StreamingResponse(stream_json_array(find), media_type="application/json", headers=cache_headers)
+    
+    # Fetch one extra row to learn whether another page exists
+    items = await find.limit(limit + 1).to_list(length=None)
+    if len(items) > limit:
+        items = items[:limit]
+        cache_headers["X-Next-Cursor"] = encode_cursor(items[-1])
+    
+    return FastJSONResponse(items, headers=cache_headers)
+
+@app.get("/api/items/changes")
+@app.get("/api/walls/{wall_id}/items/changes")
+async def get_item_changes(request: Request, wall: dict = Depends(current_wall), since: int = Query(0, ge=0)):
+    wall_id = wall["id"]
+    counter = await items_counter(wall_id)
+    version = counter["seq"]
+    etag = f'"changes-{items_validator(counter)}-{since}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(cache_headers)
+    
+    if since >= version:
+        return FastJSONResponse({"version": version, "items": [], "deleted": [], "has_more": False}, headers=cache_headers)
+    
+    replay_from = max(since - CHANGES_REPLAY_WINDOW, 0)
+    changed = await items_collection.find(
+        {"wall_id": wall_id, "version": {"$gt": replay_from}}, {"_id": 0}
+    ).sort("version", 1).to_list(length=ITEMS_PAGE_MAX + 1)
+    
+    # Page large backlogs; the client resumes from the last version it received
+    has_more = len(changed) > ITEMS_PAGE_MAX
+    if has_more:
+        changed = changed[:ITEMS_PAGE_MAX]
+        version = changed[-1]["version"]
+    
+    return FastJSONResponse({
+        "version": version,
+        "items": [item for item in changed if not item.get("deleted")],
+        "deleted": [item["id"] for item in changed if item.get("deleted")],
+        "has_more": has_more,
+    }, headers=cache_headers)
+
+@app.get("/api/items/search")
+@app.get("/api/walls/{wall_id}/items/search")
+async def search_items(
+    wall: dict = Depends(current_wall),
+    q: str = Query(..., min_length=1, max_length=SEARCH_QUERY_MAX_LENGTH),
+    limit: int = Query(20, ge=1, le=SEARCH_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, pattern="^canvas$"),
+):
+    wall_id = wall["id"]
+    offset = decode_offset(cursor)
+    headers = {"Cache-Control": "no-cache"}
+    
+    snapshot = wall_snapshots.ready(wall_id) if WALL_SNAPSHOT else None
+    if snapshot:
+        total, ids, truncated = snapshot.search.search(q, offset, limit)
+        if truncated:
+            # A short query word matched more words than are expanded, so
+            # some matches are missing and the count is a lower bound
+            headers["X-Total-Count-Truncated"] = "true"
+        body = b"[" + b",".join(snapshot.encoded[item_id][fields or "full"] for item_id in ids) + b"]"
+    else:
+        query = {"wall_id": wall_id, **LIVE_ITEMS, "$text": {"$search": q}}
+        projection = {**(CANVAS_FIELDS if fields == "canvas" else {"_id": 0}), "score": {"$meta": "textScore"}}
+        total = await items_collection.count_documents(query)
+        items = await items_collection.find(query, projection).sort(
+            [("score", {"$meta": "textScore"})] + ITEMS_LIST_INDEX
+        ).skip(offset).limit(limit).to_list(length=None)
+        for item in items:
+            item.pop("score", None)
+        body = dumps_json(items)
+    
+    headers["X-Total-Count"] = str(total)
+    if offset + limit < total:
+        headers["X-Next-Cursor"] = encode_offset(offset + limit)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/api/items/free-slot")
+@app.get("/api/walls/{wall_id}/items/free-slot")
+async def get_free_slot(
+    wall: dict = Depends(current_wall),
+    type: str = "sticky",
+    width: Optional[int] = Query(None, gt=0),
+    height: Optional[int] = Query(None, gt=0),
+    x: Optional[float] = None,
+    y: Optional[float] = None,
+):
+    # The free slot nearest (x, y), or the first one in reading order
+    grid = await wall_grid(wall["id"])
+    near = (x, y) if is_number(x) and is_number(y) else None
+    footprint = item_footprint({"type": type, "width": width, "height": height})
+    return slot_position(*grid.free_slot(footprint, near))
+
+@app.get("/api/events")
+@app.get("/api/walls/{wall_id}/events")
+async def stream_events(wall: dict = Depends(current_wall)):
+    wall_id = wall["id"]
+    queue = events_hub.subscribe(wall_id)
+    if queue is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many viewers on this wall, try again shortly",
+            headers={"Retry-After": str(int(EVENTS_KEEPALIVE_SECONDS))},
+        )
+    
+    async def event_stream():
+        try:
+            # Tell EventSource how soon to reconnect after a resync close
+            yield "retry: 1000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                
+                lines = [f"event: {event['type']}", f"data: {json.dumps(event)}"]
+                if event.get("version") is not None:
+                    lines.insert(0, f"id: {event['version']}")
+                yield "\n".join(lines) + "\n\n"
+                
+                if event["type"] == "resync":
+                    break
+        finally:
+            events_hub.unsubscribe(wall_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/items")
-def create_item(item: WallItem, user: dict = Depends(require_auth)):
-    item_dict = item.dict()
-    item_dict["id"] = str(uuid.uuid4())
-    item_dict["created_at"] = datetime.utcnow().isoformat()
-    item_dict["created_by"] = user["id"]
+@app.post("/api/walls/{wall_id}/items")
+async def create_item(item: WallItem, wall: dict = Depends(current_wall), user: dict = Depends(require_auth)):
+    wall_id = wall["id"]
+    item_dict = new_item_document(item, user, wall_id)
     
-    # Insert and remove MongoDB's _id before returning
-    result = items_collection.insert_one(item_dict)
+    if not await reserve_wall_items(wall_id, 1):
+        raise HTTPException(status_code=403, detail="This wall is full")
+    
+    grid = None
+    try:
+        if item_dict["position"] is None:
+            grid = await wall_grid(wall_id)
+            place_item(grid, item_dict)
+        
+        digest = blob_key_from_url(item_dict.get("image_url"))
+        if digest:
+            blob = await acquire_blob(digest)
+            if not blob:
+                raise HTTPException(status_code=400, detail="Unknown upload, please upload the image again")
+            attach_blob(item_dict, blob)
+        
+        item_dict["version"] = await next_items_version(wall_id)
+        
+        # Insert and remove MongoDB's _id before returning
+        result = await items_collection.insert_one(item_dict)
+        await items_written(wall_id)
+    except BaseException:
+        if grid:
+            grid.remove(item_dict["id"])
+        if item_dict.get("blob"):
+            await release_blob(item_dict["blob"])
+        await release_wall_items(wall_id, 1)
+        raise
     
     # Return without _id field
-    return {k: v for k, v in item_dict.items() if k != "_id"}
+    created_item = {k: v for k, v in item_dict.items() if k != "_id"}
+    await publish_item_event("created", created_item)
+    return created_item
 
 @app.put("/api/items/{item_id}")
-def update_item(item_id: str, update_data: ItemUpdate, user: dict = Depends(require_auth)):
-    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
+@app.put("/api/walls/{wall_id}/items/{item_id}")
+async def update_item(
+    item_id: str,
+    update_data: ItemUpdate,
+    wall: dict = Depends(current_wall),
+    user: dict = Depends(require_auth),
+):
+    update_dict = item_changes(update_data)
     
     if not update_dict:
         raise HTTPException(status_code=400, detail="No valid fields to update")
     
-    result = items_collection.update_one(
-        {"id": item_id},
-        {"$set": update_dict}
+    # Drag moves are merged in memory and written a few at a time
+    if POSITION_COALESCE and update_dict.keys() == {"position"}:
+        return await position_buffer.update(
+            item_id, wall["id"], update_dict["position"], update_data.revision, bool(update_data.final)
+        )
+    
+    # Anything else goes straight through, after any buffered move it follows
+    await position_buffer.flush([item_id])
+    position_buffer.discard(item_id)
+    position_buffer.check(item_id)
+    
+    query = {"id": item_id, "wall_id": wall["id"], **LIVE_ITEMS}
+    if update_data.revision is not None:
+        query.update(revision_filter(update_data.revision))
+    update_dict["version"] = await next_items_version(wall["id"])
+    updated_item = await items_collection.find_one_and_update(
+        query,
+        {"$set": update_dict, "$inc": {"revision": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
     )
     
-    if result.matched_count == 0:
+    if updated_item is None:
+        if update_data.revision is not None:
+            current = await items_collection.find_one({"id": item_id, "wall_id": wall["id"], **LIVE_ITEMS}, {"revision": 1})
+            if current:
+                raise stale_revision(current.get("revision", 0))
         raise HTTPException(status_code=404, detail="Item not found")
     
-    updated_item = items_collection.find_one({"id": item_id}, {"_id": 0})
+    await items_written(wall["id"])
+    await publish_item_event("updated", updated_item)
     return updated_item
 
 @app.delete("/api/items/{item_id}")
-def delete_item(item_id: str, user: dict = Depends(require_auth)):
-    item = items_collection.find_one({"id": item_id})
+@app.delete("/api/walls/{wall_id}/items/{item_id}")
+async def delete_item(item_id: str, wall: dict = Depends(current_wall), user: dict = Depends(require_auth)):
+    wall_id = wall["id"]
+    item = await items_collection.find_one({"id": item_id, "wall_id": wall_id, **LIVE_ITEMS})
     
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     
-    # Delete associated image file if exists
-    if item.get("image_url"):
-        filename = item["image_url"].split("/")[-1]
-        file_path = UPLOADS_DIR / filename
-        if file_path.exists():
-            file_path.unlink()
+    version = await next_items_version(wall_id)
+    result = await items_collection.update_one({"id": item_id, **LIVE_ITEMS}, tombstone_update(version))
+    if not result.modified_count:
+        # A concurrent delete got there first and did the cleanup
+        raise HTTPException(status_code=404, detail="Item not found")
     
-    items_collection.delete_one({"id": item_id})
+    await items_written(wall_id)
+    position_buffer.discard(item_id)
+    await release_wall_items(wall_id, 1)
+    await release_item_uploads([item])
+    await publish_item_event("deleted", {"id": item_id, "wall_id": wall_id, "version": version})
     
     return {"message": "Item deleted successfully"}
 
+@app.post("/api/items/batch")
+@app.post("/api/walls/{wall_id}/items/batch")
+async def batch_items(batch: ItemBatch, wall: dict = Depends(current_wall), user: dict = Depends(require_auth)):
+    wall_id = wall["id"]
+    operations = batch.operations
+    if len(operations) > ITEMS_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {ITEMS_BATCH_MAX} operations per batch")
+    
+    # Unordered bulk writes may apply in any order, so two operations on one
+    # item would race each other
+    targets = [operation.id for operation in operations if operation.op in ("update", "delete") and operation.id]
+    if len(targets) != len(set(targets)):
+        raise HTTPException(status_code=400, detail="Each item may appear only once per batch")
+    
+    # Buffered moves land first, so revisions below are current
+    if targets:
+        await position_buffer.flush(targets)
+        for item_id in targets:
+            position_buffer.discard(item_id)
+    
+    results = [None] * len(operations)
+    
+    def fail(index: int, status_code: int, detail: str):
+        operation = operations[index]
+        results[index] = {"op": operation.op, "id": operation.id, "status": status_code, "detail": detail}
+    
+    accepted = []
+    for index, operation in enumerate(operations):
+        error = batch_operation_error(operation)
+        if error:
+            fail(index, 400, error)
+        else:
+            accepted.append(index)
+    
+    # One read for every item the batch touches
+    existing = {}
+    if targets:
+        async for item in items_collection.find({"id": {"$in": targets}, "wall_id": wall_id, **LIVE_ITEMS}, {"_id": 0}):
+            existing[item["id"]] = item
+    
+    documents = {}
+    for index in list(accepted):
+        operation = operations[index]
+        if operation.op == "create":
+            documents[index] = new_item_document(operation.item, user, wall_id)
+        elif operation.id not in existing:
+            fail(index, 404, "Item not found")
+            accepted.remove(index)
+        elif operation.op == "update" and operation.changes.revision not in (None, existing[operation.id].get("revision", 0)):
+            fail(index, 409, "Item was changed by someone else, reload it and try again")
+            accepted.remove(index)
+    
+    # Room for every create is reserved up front, all or nothing; whatever
+    # goes unused is handed back at the end
+    reserved = len(documents)
+    if not await reserve_wall_items(wall_id, reserved):
+        for index in documents:
+            fail(index, 403, "This wall is full")
+            accepted.remove(index)
+        documents.clear()
+        reserved = 0
+    
+    grid = None
+    unplaced = [document for document in documents.values() if document["position"] is None]
+    if unplaced:
+        grid = await wall_grid(wall_id)
+        for document in unplaced:
+            place_item(grid, document)
+    
+    # One reference increment per distinct upload, however many items share it
+    blob_refs = Counter()
+    for document in documents.values():
+        digest = blob_key_from_url(document.get("image_url"))
+        if digest:
+            blob_refs[digest] += 1
+    blobs = {}
+    for digest, count in blob_refs.items():
+        blob = await acquire_blob(digest, count)
+        if blob:
+            blobs[digest] = blob
+    for index in list(documents):
+        digest = blob_key_from_url(documents[index].get("image_url"))
+        if not digest:
+            continue
+        if digest in blobs:
+            attach_blob(documents[index], blobs[digest])
+        else:
+            fail(index, 400, "Unknown upload, please upload the image again")
+            accepted.remove(index)
+            if grid:
+                grid.remove(documents[index]["id"])
+            del documents[index]
+    
+    if not accepted:
+        await release_wall_items(wall_id, reserved)
+        return {"version": await current_items_version(wall_id), "results": results}
+    
+    versions = dict(zip(accepted, await next_items_versions(wall_id, len(accepted))))
+    requests = []
+    for index in accepted:
+        operation = operations[index]
+        if operation.op == "create":
+            documents[index]["version"] = versions[index]
+            requests.append(InsertOne(documents[index]))
+        elif operation.op == "update":
+            changes = {**item_changes(operation.changes), "version": versions[index]}
+            query = {"id": operation.id, **LIVE_ITEMS}
+            if operation.changes.revision is not None:
+                query.update(revision_filter(operation.changes.revision))
+            requests.append(UpdateOne(query, {"$set": changes, "$inc": {"revision": 1}}))
+        else:
+            requests.append(UpdateOne({"id": operation.id, **LIVE_ITEMS}, tombstone_update(versions[index])))
+    
+    failed_writes = set()
+    try:
+        await items_collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        failed_writes = {accepted[error["index"]] for error in e.details["writeErrors"]}
+    await items_written(wall_id)
+    
+    # Read updated items back in one query. An item written by this batch
+    # carries the version reserved for it; anything else means a concurrent
+    # delete got there first.
+    written = {}
+    touched = [operations[index].id for index in accepted if operations[index].op in ("update", "delete")]
+    if touched:
+        async for item in items_collection.find({"id": {"$in": touched}}, {"_id": 0}):
+            written[item["id"]] = item
+    
+    created = 0
+    deleted_items = []
+    orphaned_refs = []
+    for index in accepted:
+        operation = operations[index]
+        if operation.op == "create":
+            if index in failed_writes:
+                if documents[index].get("blob"):
+                    orphaned_refs.append({"blob": documents[index]["blob"]})
+                if grid:
+                    grid.remove(documents[index]["id"])
+                fail(index, 500, "Write failed")
+                continue
+            created += 1
+            created_item = {k: v for k, v in documents[index].items() if k != "_id"}
+            results[index] = {"op": "create", "id": created_item["id"], "status": 201, "item": created_item}
+            await publish_item_event("created", created_item)
+            continue
+        
+        item = written.get(operation.id)
+        if index in failed_writes or not item:
+            fail(index, 404, "Item not found")
+        elif item.get("version") != versions[index]:
+            if item.get("deleted"):
+                fail(index, 404, "Item not found")
+            else:
+                # A concurrent write moved the item past the revision this one expected
+                fail(index, 409, "Item was changed by someone else, reload it and try again")
+        elif operation.op == "update":
+            results[index] = {"op": "update", "id": operation.id, "status": 200, "item": item}
+            await publish_item_event("updated", item)
+        else:
+            results[index] = {"op": "delete", "id": operation.id, "status": 200}
+            deleted_items.append(existing[operation.id])
+            await publish_item_event("deleted", {"id": operation.id, "wall_id": wall_id, "version": versions[index]})
+    
+    await release_wall_items(wall_id, reserved - created + len(deleted_items))
+    await release_item_uploads(deleted_items + orphaned_refs)
+    
+    return {"version": max(versions.values()), "results": results}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Wall of Love Backend Benchmark
+Seeds a wall, drives concurrent viewer, editor, upload and login workloads,
+and reports latency percentiles, throughput and server memory. Results can
+be saved as a JSON baseline and later runs compared against it.
+
+    # Against a running server (with real MongoDB)
+    python3 backend_benchmark.py --items 10000 --server-pid $(pgrep -f server.py)
+
+    # Self-contained: server.py in-process on an in-memory mongomock database
+    python3 backend_benchmark.py --mock-mongo --items 1000 --save baseline.json
+    python3 backend_benchmark.py --mock-mongo --items 1000 --compare baseline.json
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+BASE_URL = "http://localhost:8001/api"
+SEED_BATCH_SIZE = 500  # server default for ITEMS_BATCH_MAX
+CANVAS_SIZE = 5000
+STICKY_COLORS = ["yellow", "pink", "blue", "green"]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def read_rss(pid):
+    """Resident set size of a process in bytes, or None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def random_position():
+    return {"x": random.randint(0, CANVAS_SIZE), "y": random.randint(0, CANVAS_SIZE)}
+
+
+def random_png():
+    """Small noise image; random pixels keep the upload store from deduplicating it"""
+    img = Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(items):
+    """Run server.py in this process on an in-memory mongomock database"""
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("--mock-mongo needs the mongomock-motor package (pip install mongomock-motor)")
+    import uvicorn
+
+    os.environ.setdefault("UPLOADS_DIR", tempfile.mkdtemp(prefix="wall-bench-"))
+    os.environ.setdefault("QUERY_PLAN_CHECK", "0")  # mongomock cannot explain
+    os.environ.setdefault("RATE_LIMIT", "0")  # every simulated client shares one address
+    os.environ.setdefault("WALL_ITEM_QUOTA", str(max(items, 10000)))  # the seed lands on one wall
+    sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+    import server
+
+    mock = AsyncMongoMockClient()
+    db = mock["wall_of_love"]
+    server.client, server.db = mock, db
+    for name in ("users", "items", "counters", "blobs", "walls"):
+        setattr(server, f"{name}_collection", db[name])
+    server.INDEXES = [(db[collection.name], keys, options) for collection, keys, options in server.INDEXES]
+    server.OBSOLETE_INDEXES = [(db[collection.name], *names) for collection, *names in server.OBSOLETE_INDEXES]
+    if isinstance(server.events_broker, server.MongoChangeStreamBroker):
+        server.events_broker = server.LocalBroker()
+
+    port = free_port()
+    uv = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=uv.run, daemon=True).start()
+    while not uv.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/api", uv
+
+
+class WallBenchmark:
+    def __init__(self, base_url, args):
+        self.base_url = base_url
+        self.args = args
+        self.item_ids = []
+        self.email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        self.password = "bench-password"
+        self.token = None
+
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def register(self):
+        response = requests.post(f"{self.base_url}/auth/register", json={
+            "email": self.email,
+            "password": self.password,
+            "name": "Benchmark",
+        })
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+    def seed(self, count):
+        """Create `count` items through the batch endpoint"""
+        session = requests.Session()
+        session.headers.update(self.auth_headers())
+        started = time.perf_counter()
+        for start in range(0, count, SEED_BATCH_SIZE):
+            operations = []
+            for _ in range(min(SEED_BATCH_SIZE, count - start)):
+                operations.append({"op": "create", "item": {
+                    "type": "sticky",
+                    "content": uuid.uuid4().hex,
+                    "position": random_position(),
+                    "background_color": random.choice(STICKY_COLORS),
+                }})
+            response = session.post(f"{self.base_url}/items/batch", json={"operations": operations})
+            response.raise_for_status()
+            results = response.json()["results"]
+            self.item_ids.extend(r["id"] for r in results if r["status"] == 201)
+            failed = [r for r in results if r["status"] != 201]
+            if failed:
+                # Typically 403: the wall is at its item quota
+                raise RuntimeError(
+                    f"Seeded {len(self.item_ids)} of {count} items; {len(failed)} creates failed "
+                    f"({failed[0]['status']} {failed[0].get('detail')})"
+                )
+        return time.perf_counter() - started
+
+    # Workloads: each takes a worker's session and issues one request
+    def view(self, session):
+        return session.get(f"{self.base_url}/items")
+
+    def drag(self, session):
+        item_id = random.choice(self.item_ids)
+        return session.put(
+            f"{self.base_url}/items/{item_id}",
+            json={"position": random_position()},
+            headers=self.auth_headers(),
+        )
+
+    def upload(self, session):
+        return session.post(
+            f"{self.base_url}/upload",
+            files={"file": ("bench.png", random_png(), "image/png")},
+            headers=self.auth_headers(),
+        )
+
+    def login(self, session):
+        return session.post(f"{self.base_url}/auth/login", json={"email": self.email, "password": self.password})
+
+    def run_workloads(self, duration):
+        workloads = {
+            "view_items": (self.view, self.args.viewers),
+            "drag_items": (self.drag, self.args.editors if self.item_ids else 0),
+            "upload": (self.upload, self.args.uploaders),
+            "login": (self.login, self.args.logins),
+        }
+        samples = {name: [] for name, (_, workers) in workloads.items() if workers}
+        deadline = time.perf_counter() + duration
+
+        def worker(name, action):
+            session = requests.Session()
+            records = []
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = action(session).status_code
+                except requests.RequestException:
+                    status = "error"
+                records.append((time.perf_counter() - started, status))
+            samples[name].extend(records)
+
+        threads = [
+            threading.Thread(target=worker, args=(name, action))
+            for name, (action, workers) in workloads.items() for _ in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return {name: summarize(records, duration) for name, records in samples.items()}
+
+
+def summarize(records, duration):
+    latencies = sorted(latency for latency, _ in records)
+    statuses = Counter(str(status) for _, status in records)
+    errors = sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 400)
+    return {
+        "requests": len(records),
+        "errors": errors,
+        "throughput_rps": round(len(records) / duration, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "statuses": dict(statuses),
+    }
+
+
+class RssSampler:
+    """Samples a process's RSS once a second to find the peak during a run"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.start = read_rss(pid) if pid else None
+        self.peak = self.start
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(1.0):
+            rss = read_rss(self.pid)
+            if rss and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self):
+        if self.pid:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+
+    def report(self):
+        if not self.pid:
+            return None
+        return {"start_bytes": self.start, "end_bytes": read_rss(self.pid), "peak_bytes": self.peak}
+
+
+def compare(baseline, result, tolerance):
+    """Regressions of p95 latency or throughput beyond `tolerance` (a fraction)"""
+    regressions = []
+    for name, current in result["workloads"].items():
+        base = baseline.get("workloads", {}).get(name)
+        if not base:
+            continue
+        if base["p95_ms"] and current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+        if base["throughput_rps"] and current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {current['throughput_rps']} req/s")
+    return regressions
+
+
+def print_report(result):
+    print(f"\n📊 {result['config']['items']} items, {result['config']['duration']}s")
+    print(f"{'workload':<12} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, stats in result["workloads"].items():
+        print(
+            f"{name:<12} {stats['throughput_rps']:>9} {stats['p50_ms']:>9} "
+            f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['errors']:>7}"
+        )
+    if result["rss"]:
+        rss = result["rss"]
+        print(f"Server RSS: start {rss['start_bytes'] / 2**20:.1f} MiB, peak {rss['peak_bytes'] / 2**20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--mock-mongo", action="store_true", help="run server.py in-process on mongomock")
+    parser.add_argument("--items", type=int, default=1000, help="items to seed before the run")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run the workloads")
+    parser.add_argument("--viewers", type=int, default=8, help="concurrent GET /api/items pollers")
+    parser.add_argument("--editors", type=int, default=4, help="concurrent PUT /api/items/{id} draggers")
+    parser.add_argument("--uploaders", type=int, default=1, help="concurrent POST /api/upload clients")
+    parser.add_argument("--logins", type=int, default=2, help="concurrent POST /api/auth/login clients")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for positions and item choice")
+    parser.add_argument("--server-pid", type=int, help="server process whose RSS to report")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    base_url, pid = args.base_url, args.server_pid
+    if args.mock_mongo:
+        base_url, uv = start_mock_server(args.items)
+        pid = os.getpid()
+
+    bench = WallBenchmark(base_url, args)
+    bench.register()
+    print(f"🌱 Seeding {args.items} items")
+    seed_seconds = bench.seed(args.items)
+
+    print(f"🚀 Running workloads for {args.duration}s")
+    with RssSampler(pid) as rss:
+        workloads = bench.run_workloads(args.duration)
+
+    result = {
+        "started_at": datetime.utcnow().isoformat(),
+        "config": {
+            "items": args.items,
+            "duration": args.duration,
+            "viewers": args.viewers,
+            "editors": args.editors,
+            "uploaders": args.uploaders,
+            "logins": args.logins,
+            "seed": args.seed,
+            "mock_mongo": args.mock_mongo,
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "workloads": workloads,
+        "rss": rss.report(),
+    }
+    print_report(result)
+
+    if args.mock_mongo:
+        uv.should_exit = True
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"💾 Saved results to {args.save}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline.get("config", {}).get("items") != args.items:
+            print("⚠️  Baseline was recorded with a different item count")
+        regressions = compare(baseline, result, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\n✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
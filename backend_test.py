@@ -5,9 +5,17 @@ Comprehensive testing for authentication, CRUD operations, file uploads, and acc
 """
 
 import requests
+import asyncio
+import gzip
+import ipaddress
 import json
 import os
+import sys
+import tarfile
 import tempfile
+import threading
+import time
+from pathlib import Path
 from PIL import Image
 import io
 
@@ -25,6 +33,7 @@ class WallOfLoveAPITester:
         self.auth_token = None
         self.test_results = []
         self.created_items = []
+        self.server = None
         
     def log_result(self, test_name, success, message, response_data=None):
         """Log test results"""
@@ -40,6 +49,19 @@ class WallOfLoveAPITester:
         if response_data and not success:
             print(f"   Response: {response_data}")
     
+    def log_skip(self, test_name, reason):
+        """Report a test that cannot run here; it counts neither way"""
+        print(f"⏭️  SKIP: {test_name} - {reason}")
+    
+    def load_server(self):
+        """Import the backend module for tests that drive its parts directly"""
+        if self.server is None:
+            os.environ.setdefault("UPLOADS_DIR", tempfile.mkdtemp(prefix="wall-test-"))
+            sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+            import server
+            self.server = server
+        return self.server
+    
     def create_test_image(self):
         """Create a test image file"""
         img = Image.new('RGB', (100, 100), color='red')
@@ -186,6 +208,59 @@ class WallOfLoveAPITester:
             self.log_result("Public Items Access", False, f"Error: {str(e)}")
         return False
     
+    def test_items_pagination(self):
+        """Test keyset pagination of the items endpoint"""
+        try:
+            seen = []
+            cursor = None
+            while True:
+                params = {"limit": 2}
+                if cursor:
+                    params["cursor"] = cursor
+                response = self.session.get(f"{BASE_URL}/items", params=params)
+                if response.status_code != 200:
+                    self.log_result("Items Pagination", False, f"HTTP {response.status_code}: {response.text}")
+                    return False
+                page = response.json()
+                if len(page) > 2:
+                    self.log_result("Items Pagination", False, f"Page larger than limit: {len(page)} items")
+                    return False
+                seen.extend(item["id"] for item in page)
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+            
+            full = self.session.get(f"{BASE_URL}/items").json()
+            if seen == [item["id"] for item in full]:
+                self.log_result("Items Pagination", True, f"Paged through {len(seen)} items in order")
+                return True
+            else:
+                self.log_result("Items Pagination", False, "Paged items do not match the full listing")
+        except Exception as e:
+            self.log_result("Items Pagination", False, f"Error: {str(e)}")
+        return False
+    
+    def test_items_viewport(self):
+        """Test viewport-windowed items query"""
+        try:
+            params = {"x_min": 50, "x_max": 150, "y_min": 50, "y_max": 150}
+            response = self.session.get(f"{BASE_URL}/items", params=params)
+            
+            if response.status_code == 200:
+                data = response.json()
+                outside = [item for item in data
+                           if not (50 <= item["position"].get("x", -1) <= 150 and 50 <= item["position"].get("y", -1) <= 150)]
+                if not outside:
+                    self.log_result("Items Viewport", True, f"Viewport returned {len(data)} items, all inside the window")
+                    return True
+                else:
+                    self.log_result("Items Viewport", False, f"Items outside the viewport: {outside}")
+            else:
+                self.log_result("Items Viewport", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Items Viewport", False, f"Error: {str(e)}")
+        return False
+    
     def test_create_sticky_note(self, color="yellow", content="Test sticky note"):
         """Test creating a sticky note"""
         if not self.auth_token:
@@ -265,6 +340,31 @@ class WallOfLoveAPITester:
             self.log_result("Update Sticky Position", False, f"Error: {str(e)}")
         return False
     
+    def test_item_changes(self, item_id):
+        """Test delta sync picks up an update made after a known version"""
+        if not self.auth_token:
+            self.log_result("Item Changes", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            version = int(self.session.get(f"{BASE_URL}/items").headers["X-Items-Version"])
+            self.session.put(f"{BASE_URL}/items/{item_id}", json={"caption": "Delta sync"}, headers=headers)
+            response = self.session.get(f"{BASE_URL}/items/changes", params={"since": version})
+            
+            if response.status_code == 200:
+                data = response.json()
+                if item_id in [item["id"] for item in data["items"]] and data["version"] > version:
+                    self.log_result("Item Changes", True, f"Delta sync returned {len(data['items'])} changed items")
+                    return True
+                else:
+                    self.log_result("Item Changes", False, f"Updated item missing from changes: {data}")
+            else:
+                self.log_result("Item Changes", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Item Changes", False, f"Error: {str(e)}")
+        return False
+    
     def test_file_upload(self):
         """Test file upload functionality"""
         if not self.auth_token:
@@ -323,6 +423,867 @@ class WallOfLoveAPITester:
             self.log_result("Create Image Item", False, f"Error: {str(e)}")
         return None
     
+    def test_batch_operations(self):
+        """Test batch create, update and delete with per-operation statuses"""
+        if not self.auth_token:
+            self.log_result("Batch Operations", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            count_before = self.session.get(f"{BASE_URL}/walls/default").json()["item_count"]
+            
+            creates = [{"op": "create", "item": {"type": "sticky", "content": f"Batch note {n}"}} for n in range(2)]
+            response = self.session.post(f"{BASE_URL}/items/batch", json={"operations": creates}, headers=headers)
+            if response.status_code != 200:
+                self.log_result("Batch Operations", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            results = response.json()["results"]
+            if [result["status"] for result in results] != [201, 201]:
+                self.log_result("Batch Operations", False, f"Unexpected create statuses: {results}")
+                return False
+            kept, removed = (result["id"] for result in results)
+            self.created_items.append(kept)
+            
+            operations = [
+                {"op": "update", "id": kept, "changes": {"content": "Batch note updated"}},
+                {"op": "delete", "id": removed},
+                {"op": "delete", "id": "no-such-item"},
+            ]
+            response = self.session.post(f"{BASE_URL}/items/batch", json={"operations": operations}, headers=headers)
+            if response.status_code != 200:
+                self.log_result("Batch Operations", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            results = response.json()["results"]
+            statuses = [result["status"] for result in results]
+            count_after = self.session.get(f"{BASE_URL}/walls/default").json()["item_count"]
+            
+            if statuses == [200, 200, 404] and results[0]["item"]["content"] == "Batch note updated" and count_after == count_before + 1:
+                self.log_result("Batch Operations", True, f"Batch statuses {statuses}, item count {count_before} -> {count_after}")
+                return True
+            else:
+                self.log_result("Batch Operations", False, f"Statuses {statuses}, item count {count_before} -> {count_after}", results)
+        except Exception as e:
+            self.log_result("Batch Operations", False, f"Error: {str(e)}")
+        return False
+    
+    def test_stale_revision(self, item_id):
+        """Test an update based on an old revision is rejected with 409"""
+        if not self.auth_token:
+            self.log_result("Stale Revision", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            response = self.session.put(f"{BASE_URL}/items/{item_id}", json={"caption": "Revision check"}, headers=headers)
+            if response.status_code != 200:
+                self.log_result("Stale Revision", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            revision = response.json()["revision"]
+            
+            payload = {"caption": "Stale edit", "revision": revision - 1}
+            response = self.session.put(f"{BASE_URL}/items/{item_id}", json=payload, headers=headers)
+            if response.status_code == 409 and response.headers.get("X-Item-Revision") == str(revision):
+                self.log_result("Stale Revision", True, "Rejected an update based on an old revision")
+                return True
+            else:
+                self.log_result("Stale Revision", False, f"Expected 409, got {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Stale Revision", False, f"Error: {str(e)}")
+        return False
+    
+    def test_search(self):
+        """Test search finds a sticky note by a word in its content"""
+        if not self.auth_token:
+            self.log_result("Search", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            payload = {"type": "sticky", "content": "Searchable kumquat feedback"}
+            response = self.session.post(f"{BASE_URL}/items", json=payload, headers=headers)
+            if response.status_code != 200:
+                self.log_result("Search", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            item_id = response.json()["id"]
+            self.created_items.append(item_id)
+            
+            response = self.session.get(f"{BASE_URL}/items/search", params={"q": "kumquat"})
+            if response.status_code == 200:
+                data = response.json()
+                if item_id in [item["id"] for item in data]:
+                    self.log_result("Search", True, f"Search found the new sticky note among {len(data)} results")
+                    return True
+                else:
+                    self.log_result("Search", False, f"New sticky note missing from results: {data}")
+            else:
+                self.log_result("Search", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Search", False, f"Error: {str(e)}")
+        return False
+    
+    def test_export_import(self):
+        """Test exporting the wall and importing it into a new wall"""
+        if not self.auth_token:
+            self.log_result("Export and Import", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            expected = len(self.session.get(f"{BASE_URL}/items").json())
+            
+            response = self.session.get(f"{BASE_URL}/export", headers=headers)
+            if response.status_code != 200:
+                self.log_result("Export and Import", False, f"Export HTTP {response.status_code}: {response.text}")
+                return False
+            archive = response.content
+            
+            wall = self.session.post(f"{BASE_URL}/walls", json={"name": "Imported wall"}, headers=headers).json()
+            response = self.session.post(f"{BASE_URL}/walls/{wall['id']}/import", data=archive, headers=headers)
+            if response.status_code != 200:
+                self.log_result("Export and Import", False, f"Import HTTP {response.status_code}: {response.text}")
+                return False
+            data = response.json()
+            imported = self.session.get(f"{BASE_URL}/walls/{wall['id']}").json()["item_count"]
+            
+            if data["items"] == expected and imported == expected:
+                self.log_result("Export and Import", True, f"Imported {imported} items into a new wall")
+                return True
+            else:
+                self.log_result("Export and Import", False, f"Expected {expected} items, import reported {data['items']} and the wall holds {imported}", data)
+        except Exception as e:
+            self.log_result("Export and Import", False, f"Error: {str(e)}")
+        return False
+    
+    def test_event_stream(self):
+        """Test a viewer's event stream receives an item created after it connected"""
+        if not self.auth_token:
+            self.log_result("Event Stream", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            event = None
+            with self.session.get(f"{BASE_URL}/events", stream=True, timeout=10) as stream:
+                if stream.status_code != 200:
+                    self.log_result("Event Stream", False, f"HTTP {stream.status_code}: {stream.text}")
+                    return False
+                lines = stream.iter_lines(chunk_size=1, decode_unicode=True)
+                next(lines)  # the retry hint, sent as soon as the stream opens
+                
+                payload = {"type": "sticky", "content": "Streamed sticky note", "position": {"x": 400, "y": 100}}
+                response = self.session.post(f"{BASE_URL}/items", json=payload, headers=headers)
+                if response.status_code != 200:
+                    self.log_result("Event Stream", False, f"HTTP {response.status_code}: {response.text}")
+                    return False
+                item_id = response.json()["id"]
+                self.created_items.append(item_id)
+                
+                for line in lines:
+                    if line.startswith("data: "):
+                        data = json.loads(line[len("data: "):])
+                        if data.get("item", {}).get("id") == item_id:
+                            event = data
+                            break
+            
+            if event and event["type"] == "created" and event["item"]["content"] == "Streamed sticky note":
+                self.log_result("Event Stream", True, f"Received the created event at version {event['version']}")
+                return True
+            else:
+                self.log_result("Event Stream", False, f"Unexpected event: {event}")
+        except Exception as e:
+            self.log_result("Event Stream", False, f"Error: {str(e)}")
+        return False
+    
+    def test_slow_consumer_resync(self):
+        """Test a viewer that stops reading is told to resync instead of holding back the others"""
+        try:
+            server = self.load_server()
+            hub = server.EventHub(2, 10)
+            slow, fast = hub.subscribe("default"), hub.subscribe("default")
+            for version in range(1, 4):
+                hub.dispatch({"type": "updated", "wall_id": "default", "version": version, "item": {"id": "resync-check"}})
+                fast.get_nowait()
+            backlog = [slow.get_nowait() for _ in range(slow.qsize())]
+            subscribers = hub.subscribers.get("default", set())
+            
+            if backlog == [{"type": "resync"}] and slow not in subscribers and fast in subscribers:
+                self.log_result("Slow Consumer Resync", True, "Overflowing viewer got a resync and was dropped, the other kept up")
+                return True
+            else:
+                self.log_result("Slow Consumer Resync", False, f"Slow viewer's backlog: {backlog}")
+        except Exception as e:
+            self.log_result("Slow Consumer Resync", False, f"Error: {str(e)}")
+        return False
+    
+    def test_upload_validation(self):
+        """Test non-image and oversized uploads are rejected"""
+        if not self.auth_token:
+            self.log_result("Upload Validation", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            files = {'file': ('notes.png', io.BytesIO(b"this is not an image"), 'image/png')}
+            response = self.session.post(f"{BASE_URL}/upload", files=files, headers=headers)
+            if response.status_code != 400:
+                self.log_result("Upload Validation", False, f"Expected 400 for non-image bytes, got {response.status_code}: {response.text}")
+                return False
+            
+            # Past the default 10 MiB cap
+            files = {'file': ('huge.png', io.BytesIO(b"\0" * (11 * 1024 * 1024)), 'image/png')}
+            response = self.session.post(f"{BASE_URL}/upload", files=files, headers=headers)
+            if response.status_code == 413:
+                self.log_result("Upload Validation", True, "Rejected non-image bytes with 400 and an oversized file with 413")
+                return True
+            else:
+                self.log_result("Upload Validation", False, f"Expected 413 for an oversized file, got {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Upload Validation", False, f"Error: {str(e)}")
+        return False
+    
+    def test_upload_dedup(self):
+        """Test identical uploads share one URL"""
+        if not self.auth_token:
+            self.log_result("Upload Deduplication", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            urls = []
+            for _ in range(2):
+                files = {'file': ('test_image.png', self.create_test_image(), 'image/png')}
+                response = self.session.post(f"{BASE_URL}/upload", files=files, headers=headers)
+                if response.status_code != 200:
+                    self.log_result("Upload Deduplication", False, f"HTTP {response.status_code}: {response.text}")
+                    return False
+                urls.append(response.json()["url"])
+            
+            if urls[0] == urls[1]:
+                self.log_result("Upload Deduplication", True, "A repeated upload got the same URL")
+                return True
+            else:
+                self.log_result("Upload Deduplication", False, f"Identical uploads got different URLs: {urls}")
+        except Exception as e:
+            self.log_result("Upload Deduplication", False, f"Error: {str(e)}")
+        return False
+    
+    def test_s3_storage(self):
+        """Test the S3 storage driver against a bucket mocked by moto"""
+        try:
+            from moto import mock_aws
+        except ImportError:
+            self.log_skip("S3 Storage", "moto is not installed (pip install moto)")
+            return None
+            
+        try:
+            server = self.load_server()
+            with mock_aws():
+                storage = server.S3Storage("wall-test", "uploads/", region="us-east-1")
+                storage.s3.create_bucket(Bucket="wall-test")
+                
+                async def exercise():
+                    fd, name = tempfile.mkstemp(suffix=".png")
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(self.create_test_image().getvalue())
+                    await storage.put_file("ab/test.png", Path(name))
+                    stored = await storage.exists("ab/test.png")
+                    body = b"".join([chunk async for chunk in storage.read_chunks("ab/test.png")])
+                    stale = await storage.list_stale(time.time() + 60)
+                    await storage.delete(["ab/test.png"])
+                    return stored, body, stale, await storage.exists("ab/test.png")
+                
+                stored, body, stale, still_there = asyncio.run(exercise())
+                head = storage.s3.list_objects_v2(Bucket="wall-test")
+                presigned = storage.presign_put("ab/next.png", "image/png")
+            
+            if not (stored and body == self.create_test_image().getvalue()):
+                self.log_result("S3 Storage", False, "Stored object missing or its bytes differ")
+            elif stale != ["ab/test.png"] or still_there or head.get("KeyCount"):
+                self.log_result("S3 Storage", False, f"Listing or delete misbehaved: stale={stale}, still there={still_there}")
+            elif "wall-test" not in presigned or "uploads/ab/next.png" not in presigned or "Signature" not in presigned:
+                self.log_result("S3 Storage", False, f"Unexpected presigned URL: {presigned}")
+            else:
+                self.log_result("S3 Storage", True, "Stored, read, listed, deleted and presigned objects under the key prefix")
+                return True
+        except Exception as e:
+            self.log_result("S3 Storage", False, f"Error: {str(e)}")
+        return False
+    
+    def test_http_caching(self):
+        """Test conditional requests on item lists, delta sync and uploads, and byte ranges on uploads"""
+        if not self.auth_token:
+            self.log_result("HTTP Caching", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            etag = self.session.get(f"{BASE_URL}/items").headers.get("ETag")
+            response = self.session.get(f"{BASE_URL}/items", headers={"If-None-Match": etag})
+            if not etag or response.status_code != 304:
+                self.log_result("HTTP Caching", False, f"Expected 304 for ETag {etag}, got {response.status_code}")
+                return False
+            
+            # Any write has to invalidate the list's validator
+            payload = {"type": "sticky", "content": "Cache buster", "position": {"x": 500, "y": 100}}
+            item_id = self.session.post(f"{BASE_URL}/items", json=payload, headers=headers).json()["id"]
+            self.created_items.append(item_id)
+            response = self.session.get(f"{BASE_URL}/items", headers={"If-None-Match": etag})
+            if response.status_code != 200 or item_id not in [item["id"] for item in response.json()]:
+                self.log_result("HTTP Caching", False, f"Stale list after a write: HTTP {response.status_code}")
+                return False
+            
+            params = {"since": response.headers["X-Items-Version"]}
+            etag = self.session.get(f"{BASE_URL}/items/changes", params=params).headers.get("ETag")
+            response = self.session.get(f"{BASE_URL}/items/changes", params=params, headers={"If-None-Match": etag})
+            if response.status_code != 304:
+                self.log_result("HTTP Caching", False, f"Expected 304 from delta sync, got {response.status_code}")
+                return False
+            
+            files = {'file': ('cached.png', self.create_test_image(), 'image/png')}
+            url = self.session.post(f"{BASE_URL}/upload", files=files, headers=headers).json()["url"]
+            upload_url = BASE_URL[:-len("/api")] + url
+            response = self.session.get(upload_url)
+            full, etag = response.content, response.headers.get("ETag")
+            if "immutable" not in response.headers.get("Cache-Control", ""):
+                self.log_result("HTTP Caching", False, f"Upload not cached as immutable: {response.headers.get('Cache-Control')}")
+                return False
+            ranged = self.session.get(upload_url, headers={"Range": "bytes=0-9"})
+            revalidated = self.session.get(upload_url, headers={"If-None-Match": etag})
+            
+            if ranged.status_code == 206 and ranged.content == full[:10] and revalidated.status_code == 304:
+                self.log_result("HTTP Caching", True, "304s for unchanged lists, changes and uploads; 200 after a write; 206 for a range")
+                return True
+            else:
+                self.log_result("HTTP Caching", False, f"Range HTTP {ranged.status_code}, revalidation HTTP {revalidated.status_code}")
+        except Exception as e:
+            self.log_result("HTTP Caching", False, f"Error: {str(e)}")
+        return False
+    
+    def test_auth_cache(self):
+        """Test repeated authenticated requests are answered from the auth caches"""
+        if not self.auth_token:
+            self.log_result("Auth Cache", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            self.session.get(f"{BASE_URL}/auth/me", headers=headers)
+            before = self.session.get(f"{BASE_URL}/stats").json()["auth_cache"]
+            for _ in range(3):
+                self.session.get(f"{BASE_URL}/auth/me", headers=headers)
+            after = self.session.get(f"{BASE_URL}/stats").json()["auth_cache"]
+            
+            token_hits = after["tokens"]["hits"] - before["tokens"]["hits"]
+            user_hits = after["users"]["hits"] - before["users"]["hits"]
+            user_misses = after["users"]["misses"] - before["users"]["misses"]
+            if token_hits >= 3 and user_hits >= 3 and user_misses == 0:
+                self.log_result("Auth Cache", True, f"{token_hits} token and {user_hits} user cache hits, no lookups")
+                return True
+            else:
+                self.log_result("Auth Cache", False, f"Token hits {token_hits}, user hits {user_hits}, user misses {user_misses}")
+        except Exception as e:
+            self.log_result("Auth Cache", False, f"Error: {str(e)}")
+        return False
+    
+    def test_password_pool(self):
+        """Test a login burst past the password pool's queue is turned away with 503 and Retry-After"""
+        try:
+            before = self.session.get(f"{BASE_URL}/stats").json()["password_pool"]
+            statuses = []
+            retry_after = []
+            
+            def login():
+                payload = {"email": TEST_USER_EMAIL, "password": TEST_USER_PASSWORD}
+                response = requests.post(f"{BASE_URL}/auth/login", json=payload)
+                statuses.append(response.status_code)
+                if response.status_code == 503:
+                    retry_after.append(response.headers.get("Retry-After"))
+            
+            threads = [threading.Thread(target=login) for _ in range(3 * before["max_pending"])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            
+            # Hashes of callers that went away still finish in the pool
+            deadline = time.time() + 30
+            after = self.session.get(f"{BASE_URL}/stats").json()["password_pool"]
+            while after["pending"] and time.time() < deadline:
+                time.sleep(0.2)
+                after = self.session.get(f"{BASE_URL}/stats").json()["password_pool"]
+            
+            rejected = statuses.count(503)
+            if set(statuses) - {200, 503}:
+                self.log_result("Password Pool", False, f"Unexpected statuses: {sorted(set(statuses))}")
+            elif not rejected or not all(retry_after):
+                self.log_result("Password Pool", False, f"Expected 503s with Retry-After, got {rejected} rejections")
+            elif after["rejected"] - before["rejected"] != rejected or after["pending"] != 0:
+                self.log_result("Password Pool", False, f"Pool reports {after['rejected'] - before['rejected']} rejected and {after['pending']} pending", after)
+            else:
+                self.log_result("Password Pool", True, f"{rejected} of {len(statuses)} burst logins turned away with Retry-After")
+                return True
+        except Exception as e:
+            self.log_result("Password Pool", False, f"Error: {str(e)}")
+        return False
+    
+    def test_metrics(self):
+        """Test the metrics endpoint counts responses per route and readiness reports its checks"""
+        def items_responses():
+            text = self.session.get(f"{BASE_URL}/metrics").text
+            return sum(
+                float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+                if line.startswith("wall_http_responses_total{")
+                and 'method="GET"' in line and 'route="/api/items"' in line and 'status="200"' in line
+            )
+        
+        try:
+            before = items_responses()
+            for _ in range(2):
+                self.session.get(f"{BASE_URL}/items")
+            counted = items_responses() - before
+            if counted != 2:
+                self.log_result("Metrics", False, f"Expected 2 more GET /api/items responses, counted {counted}")
+                return False
+            
+            response = self.session.get(f"{BASE_URL}/ready")
+            checks = response.json().get("checks", {})
+            if response.status_code == 200 and all(check["ok"] for check in checks.values()):
+                self.log_result("Metrics", True, f"Responses counted per route; ready with checks {sorted(checks)}")
+                return True
+            else:
+                self.log_result("Metrics", False, f"Readiness HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Metrics", False, f"Error: {str(e)}")
+        return False
+    
+    def test_profiling(self):
+        """Test a request opted into profiling can be read back as a flame graph"""
+        token = os.environ.get("PROFILE_TOKEN")
+        try:
+            if not token:
+                response = self.session.get(f"{BASE_URL}/admin/profiles")
+                if response.status_code in (403, 404):
+                    self.log_result("Profiling", True, f"Profiles refused without a token (HTTP {response.status_code}); set PROFILE_TOKEN to test capture")
+                    return True
+                self.log_result("Profiling", False, f"Profiles served without a token: HTTP {response.status_code}")
+                return False
+            
+            headers = {"X-Profile-Token": token}
+            profile_id = self.session.get(f"{BASE_URL}/items", headers=headers).headers.get("X-Profile-Id")
+            if not profile_id:
+                self.log_result("Profiling", False, "Profiled request carries no X-Profile-Id")
+                return False
+            # The profile is filed once the last of the response has been sent
+            deadline = time.time() + 5
+            response = self.session.get(f"{BASE_URL}/admin/profiles/{profile_id}", headers=headers)
+            while response.status_code == 404 and time.time() < deadline:
+                time.sleep(0.1)
+                response = self.session.get(f"{BASE_URL}/admin/profiles/{profile_id}", headers=headers)
+            speedscope = response.json()
+            listed = [profile["id"] for profile in self.session.get(f"{BASE_URL}/admin/profiles", headers=headers).json()]
+            collapsed = self.session.get(f"{BASE_URL}/admin/profiles/{profile_id}", params={"format": "collapsed"}, headers=headers)
+            forbidden = self.session.get(f"{BASE_URL}/admin/profiles/{profile_id}", headers={"X-Profile-Token": token + "x"})
+            
+            if profile_id in listed and speedscope["profiles"][0]["type"] == "sampled" and collapsed.status_code == 200 and forbidden.status_code == 403:
+                self.log_result("Profiling", True, f"Profile {profile_id} listed and served as speedscope and collapsed stacks")
+                return True
+            else:
+                self.log_result("Profiling", False, f"Listed: {profile_id in listed}, collapsed HTTP {collapsed.status_code}, wrong token HTTP {forbidden.status_code}")
+        except Exception as e:
+            self.log_result("Profiling", False, f"Error: {str(e)}")
+        return False
+    
+    def test_canvas_fields(self):
+        """Test the canvas projection and the streamed full listing agree with the paged one"""
+        try:
+            full = self.session.get(f"{BASE_URL}/items").json()
+            paged = self.session.get(f"{BASE_URL}/items", params={"limit": 1000}).json()
+            canvas = self.session.get(f"{BASE_URL}/items", params={"fields": "canvas"}).json()
+            
+            extra = [item["id"] for item in canvas if "created_by" in item or "position" not in item]
+            if full != paged[:len(full)]:
+                self.log_result("Canvas Fields", False, "Streamed listing differs from the paged listing")
+            elif [item["id"] for item in canvas] != [item["id"] for item in full] or extra:
+                self.log_result("Canvas Fields", False, f"Canvas projection differs from the full listing: {extra}")
+            else:
+                self.log_result("Canvas Fields", True, f"{len(canvas)} items in canvas projection match the full listing")
+                return True
+        except Exception as e:
+            self.log_result("Canvas Fields", False, f"Error: {str(e)}")
+        return False
+    
+    def test_snapshot_coherence(self):
+        """Test the full listing reflects each write immediately, with a fresh validator"""
+        if not self.auth_token:
+            self.log_result("Snapshot Coherence", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            
+            def listing():
+                response = self.session.get(f"{BASE_URL}/items")
+                return {item["id"]: item for item in response.json()}, response.headers.get("ETag")
+            
+            _, etag = listing()
+            payload = {"type": "sticky", "content": "Snapshot sticky", "position": {"x": 600, "y": 100}}
+            item_id = self.session.post(f"{BASE_URL}/items", json=payload, headers=headers).json()["id"]
+            items, created_etag = listing()
+            created = item_id in items
+            
+            self.session.put(f"{BASE_URL}/items/{item_id}", json={"caption": "Snapshot caption"}, headers=headers)
+            items, updated_etag = listing()
+            updated = items.get(item_id, {}).get("caption") == "Snapshot caption"
+            
+            self.session.delete(f"{BASE_URL}/items/{item_id}", headers=headers)
+            items, deleted_etag = listing()
+            deleted = item_id not in items
+            
+            if created and updated and deleted and len({etag, created_etag, updated_etag, deleted_etag}) == 4:
+                self.log_result("Snapshot Coherence", True, "Create, update and delete showed up at once, each with a new ETag")
+                return True
+            else:
+                self.log_result("Snapshot Coherence", False, f"Created {created}, updated {updated}, deleted {deleted}, ETags {[etag, created_etag, updated_etag, deleted_etag]}")
+        except Exception as e:
+            self.log_result("Snapshot Coherence", False, f"Error: {str(e)}")
+        return False
+    
+    def test_compression(self):
+        """Test the item list is served in each negotiated content coding"""
+        if not self.auth_token:
+            self.log_result("Compression", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            # Enough of a wall for its listing to be worth compressing
+            creates = [
+                {"op": "create", "item": {"type": "sticky", "content": f"Compressible note {n} " * 20, "position": {"x": 100 * n, "y": 700}}}
+                for n in range(5)
+            ]
+            results = self.session.post(f"{BASE_URL}/items/batch", json={"operations": creates}, headers=headers).json()["results"]
+            self.created_items.extend(result["id"] for result in results if result["status"] == 201)
+            
+            identity = self.session.get(f"{BASE_URL}/items", headers={"Accept-Encoding": "identity"})
+            if "Content-Encoding" in identity.headers:
+                self.log_result("Compression", False, f"Identity request got {identity.headers['Content-Encoding']}")
+                return False
+            
+            decoders = {"gzip": gzip.decompress}
+            try:
+                import brotli
+                decoders["br"] = brotli.decompress
+            except ImportError:
+                pass
+            try:
+                import zstandard
+                decoders["zstd"] = lambda body: zstandard.ZstdDecompressor().decompressobj().decompress(body)
+            except ImportError:
+                pass
+            
+            served = []
+            for encoding, decode in decoders.items():
+                response = self.session.get(f"{BASE_URL}/items", headers={"Accept-Encoding": encoding}, stream=True)
+                body = response.raw.read(decode_content=False)
+                coding = response.headers.get("Content-Encoding")
+                if coding is None and encoding != "gzip":
+                    continue  # the server lacks this codec
+                if coding != encoding or json.loads(decode(body)) != identity.json():
+                    self.log_result("Compression", False, f"Asked for {encoding}, got {coding} with a different body")
+                    return False
+                if "accept-encoding" not in response.headers.get("Vary", "").lower():
+                    self.log_result("Compression", False, f"{encoding} response lacks Vary: Accept-Encoding")
+                    return False
+                served.append(f"{encoding} ({len(body)} of {len(identity.content)} bytes)")
+            
+            self.log_result("Compression", True, f"Served {', '.join(served)}")
+            return True
+        except Exception as e:
+            self.log_result("Compression", False, f"Error: {str(e)}")
+        return False
+    
+    def test_wall_isolation(self):
+        """Test items created on one wall stay off the others"""
+        if not self.auth_token:
+            self.log_result("Wall Isolation", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            wall = self.session.post(f"{BASE_URL}/walls", json={"name": "Isolation wall"}, headers=headers).json()
+            payload = {"type": "sticky", "content": "Only on its own wall", "position": {"x": 100, "y": 100}}
+            response = self.session.post(f"{BASE_URL}/walls/{wall['id']}/items", json=payload, headers=headers)
+            if response.status_code != 200:
+                self.log_result("Wall Isolation", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            item_id = response.json()["id"]
+            
+            own = [item["id"] for item in self.session.get(f"{BASE_URL}/walls/{wall['id']}/items").json()]
+            default = [item["id"] for item in self.session.get(f"{BASE_URL}/items").json()]
+            moved = self.session.put(f"{BASE_URL}/items/{item_id}", json={"caption": "Wrong wall"}, headers=headers)
+            
+            if own == [item_id] and item_id not in default and moved.status_code == 404:
+                self.log_result("Wall Isolation", True, "Item listed and editable on its own wall only")
+                return True
+            else:
+                self.log_result("Wall Isolation", False, f"Own wall lists {own}, default wall has it: {item_id in default}, cross-wall edit HTTP {moved.status_code}")
+        except Exception as e:
+            self.log_result("Wall Isolation", False, f"Error: {str(e)}")
+        return False
+    
+    def test_wall_quota(self):
+        """Test a wall turns creates away with 403 once it holds its item quota"""
+        if not self.auth_token:
+            self.log_result("Wall Quota", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            wall = self.session.post(f"{BASE_URL}/walls", json={"name": "Quota wall"}, headers=headers).json()
+            quota = wall["item_quota"]
+            if quota > 20000:
+                self.log_skip("Wall Quota", f"a quota of {quota} items is too many to fill here")
+                return None
+            
+            for start in range(0, quota, 500):
+                creates = [{"op": "create", "item": {"type": "sticky", "content": "Filler"}} for _ in range(min(500, quota - start))]
+                response = self.session.post(f"{BASE_URL}/walls/{wall['id']}/items/batch", json={"operations": creates}, headers=headers)
+                if response.status_code != 200 or any(result["status"] != 201 for result in response.json()["results"]):
+                    self.log_result("Wall Quota", False, f"Filling the wall failed at {start} items: {response.text[:200]}")
+                    return False
+            
+            payload = {"type": "sticky", "content": "One too many"}
+            response = self.session.post(f"{BASE_URL}/walls/{wall['id']}/items", json=payload, headers=headers)
+            if response.status_code == 403:
+                self.log_result("Wall Quota", True, f"Wall full at {quota} items, the next create got 403")
+                return True
+            else:
+                self.log_result("Wall Quota", False, f"Expected 403 past the quota, got {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Wall Quota", False, f"Error: {str(e)}")
+        return False
+    
+    def test_auto_placement(self):
+        """Test items created without a position land in free slots"""
+        if not self.auth_token:
+            self.log_result("Auto Placement", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            wall = self.session.post(f"{BASE_URL}/walls", json={"name": "Placement wall"}, headers=headers).json()
+            items_url = f"{BASE_URL}/walls/{wall['id']}/items"
+            
+            slot = self.session.get(f"{items_url}/free-slot").json()
+            first = self.session.post(items_url, json={"type": "sticky", "content": "Placed for me"}, headers=headers).json()
+            second = self.session.post(items_url, json={"type": "sticky", "content": "Placed next"}, headers=headers).json()
+            next_slot = self.session.get(f"{items_url}/free-slot").json()
+            
+            positions = [(item["position"]["x"], item["position"]["y"]) for item in (first, second)]
+            taken = set(positions)
+            if positions[0] == (slot["x"], slot["y"]) and len(taken) == 2 and (next_slot["x"], next_slot["y"]) not in taken:
+                self.log_result("Auto Placement", True, f"New items placed at {positions}, next free slot {next_slot['x'], next_slot['y']}")
+                return True
+            else:
+                self.log_result("Auto Placement", False, f"Free slot {slot}, placed at {positions}, next free slot {next_slot}")
+        except Exception as e:
+            self.log_result("Auto Placement", False, f"Error: {str(e)}")
+        return False
+    
+    def test_coalesced_moves(self, item_id):
+        """Test drag moves are buffered and the final one is written at once"""
+        if not self.auth_token:
+            self.log_result("Coalesced Moves", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            before = self.session.get(f"{BASE_URL}/stats").json()["position_buffer"]
+            version = self.session.get(f"{BASE_URL}/items/changes").json()["version"]
+            
+            revision = None
+            for x in (710, 720, 730):
+                payload = {"position": {"x": x, "y": 300}, "revision": revision, "final": x == 730}
+                response = self.session.put(f"{BASE_URL}/items/{item_id}", json=payload, headers=headers)
+                if response.status_code != 200:
+                    self.log_result("Coalesced Moves", False, f"HTTP {response.status_code}: {response.text}")
+                    return False
+                revision = response.json()["revision"]
+            
+            # Delta sync reads the database, so the final move has to be there already
+            changes = self.session.get(f"{BASE_URL}/items/changes", params={"since": version}).json()
+            stored = next((item for item in changes["items"] if item["id"] == item_id), None)
+            after = self.session.get(f"{BASE_URL}/stats").json()["position_buffer"]
+            coalesced = after["coalesced"] - before["coalesced"]
+            
+            if stored and stored["position"]["x"] == 730 and stored["revision"] == revision and coalesced == 3:
+                self.log_result("Coalesced Moves", True, f"3 moves buffered, the final one stored at revision {revision}")
+                return True
+            else:
+                self.log_result("Coalesced Moves", False, f"Stored {stored}, {coalesced} moves buffered")
+        except Exception as e:
+            self.log_result("Coalesced Moves", False, f"Error: {str(e)}")
+        return False
+    
+    def test_lost_buffered_move(self):
+        """Test a buffered move overtaken by another worker's write is answered with 409"""
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            self.log_skip("Lost Buffered Move", "mongomock-motor is not installed (pip install mongomock-motor)")
+            return None
+            
+        try:
+            server = self.load_server()
+            db = AsyncMongoMockClient()["wall_test"]
+            
+            async def scenario():
+                saved = server.items_collection, server.counters_collection
+                server.items_collection, server.counters_collection = db["items"], db["counters"]
+                try:
+                    await db["items"].insert_one({"id": "dragged", "wall_id": "default", "type": "sticky", "position": {"x": 0, "y": 0}, "revision": 0, "version": 1})
+                    buffer = server.PositionBuffer()
+                    await buffer.update("dragged", "default", {"x": 10, "y": 10}, 0, False)
+                    # Another worker edits the item before this one flushes the move
+                    await db["items"].update_one({"id": "dragged"}, {"$set": {"caption": "Edited elsewhere", "version": 2}, "$inc": {"revision": 1}})
+                    await buffer.flush()
+                    try:
+                        await buffer.update("dragged", "default", {"x": 20, "y": 20}, 1, False)
+                    except server.HTTPException as e:
+                        return e, await db["items"].find_one({"id": "dragged"})
+                    return None, await db["items"].find_one({"id": "dragged"})
+                finally:
+                    server.items_collection, server.counters_collection = saved
+            
+            error, stored = asyncio.run(scenario())
+            if error and error.status_code == 409 and error.headers.get("X-Item-Revision") == "1" and stored["position"] == {"x": 0, "y": 0}:
+                self.log_result("Lost Buffered Move", True, "The other worker's write stood and the next move got 409")
+                return True
+            else:
+                self.log_result("Lost Buffered Move", False, f"Next move raised {error and error.status_code}, stored position {stored['position']}")
+        except Exception as e:
+            self.log_result("Lost Buffered Move", False, f"Error: {str(e)}")
+        return False
+    
+    def test_search_truncation(self):
+        """Test a search word with too many expansions reports its count as truncated"""
+        if not self.auth_token:
+            self.log_result("Search Truncation", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            # More words sharing a prefix than one query word expands to
+            payload = {"type": "sticky", "content": " ".join(f"zq{n:03d}" for n in range(300))}
+            item_id = self.session.post(f"{BASE_URL}/items", json=payload, headers=headers).json()["id"]
+            self.created_items.append(item_id)
+            
+            broad = self.session.get(f"{BASE_URL}/items/search", params={"q": "zq"})
+            exact = self.session.get(f"{BASE_URL}/items/search", params={"q": "zq299"})
+            if broad.headers.get("X-Total-Count-Truncated") == "true" and "X-Total-Count-Truncated" not in exact.headers and exact.headers.get("X-Total-Count") == "1":
+                self.log_result("Search Truncation", True, "Broad prefix flagged as truncated, exact word counted in full")
+                return True
+            else:
+                self.log_result("Search Truncation", False, f"Broad headers {dict(broad.headers)}, exact headers {dict(exact.headers)}")
+        except Exception as e:
+            self.log_result("Search Truncation", False, f"Error: {str(e)}")
+        return False
+    
+    def archive(self, members):
+        """Build a tar archive from (name, bytes) pairs"""
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+    
+    def test_import_validation(self):
+        """Test malformed archive metadata is rejected or skipped instead of failing the import"""
+        if not self.auth_token:
+            self.log_result("Import Validation", False, "No auth token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            wall = self.session.post(f"{BASE_URL}/walls", json={"name": "Validation wall"}, headers=headers).json()
+            import_url = f"{BASE_URL}/walls/{wall['id']}/import"
+            
+            bad_manifest = self.archive([("wall.json", b"[]")])
+            response = self.session.post(import_url, data=bad_manifest, headers=headers)
+            if response.status_code != 400:
+                self.log_result("Import Validation", False, f"Expected 400 for a non-object manifest, got {response.status_code}: {response.text}")
+                return False
+            
+            item = {"type": "sticky", "content": "Imported despite bad metadata", "position": {"x": 100, "y": 100}}
+            bad_blob = self.archive([
+                ("wall.json", json.dumps({"format": 1}).encode()),
+                ("blobs/" + "0" * 64 + ".json", b"[]"),
+                ("items/000000.ndjson", json.dumps(item).encode() + b"\n"),
+            ])
+            response = self.session.post(import_url, data=bad_blob, headers=headers)
+            if response.status_code == 200 and response.json()["items"] == 1 and response.json()["skipped_files"] == 1:
+                self.log_result("Import Validation", True, "Non-object manifest got 400, non-object blob metadata was skipped")
+                return True
+            else:
+                self.log_result("Import Validation", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_result("Import Validation", False, f"Error: {str(e)}")
+        return False
+    
+    def test_rate_limits(self):
+        """Test token buckets answer 429 with Retry-After, per client behind trusted proxies"""
+        try:
+            server = self.load_server()
+            
+            async def app(scope, receive, send):
+                await send({"type": "http.response.start", "status": 200, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+            
+            middleware = server.RateLimitMiddleware(app, [server.RateLimit("login", {"POST"}, r"/api/auth/login", "2/60")])
+            
+            async def call(client, forwarded=None):
+                headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+                scope = {"type": "http", "method": "POST", "path": "/api/auth/login", "client": (client, 40000), "headers": headers}
+                messages = []
+                
+                async def receive():
+                    return {"type": "http.request", "body": b""}
+                
+                async def send(message):
+                    messages.append(message)
+                
+                await middleware(scope, receive, send)
+                return messages[0]["status"], {name.decode().lower(): value.decode() for name, value in messages[0]["headers"]}
+            
+            async def scenario():
+                saved = server.rate_limiter, server.RATE_LIMIT_TRUSTED_PROXIES
+                server.rate_limiter = server.LocalRateLimiter(100)
+                server.RATE_LIMIT_TRUSTED_PROXIES = [ipaddress.ip_network("10.0.0.0/8")]
+                try:
+                    direct = [await call("203.0.113.5") for _ in range(3)]
+                    # A client that is not a proxy cannot name another address
+                    forged = await call("203.0.113.5", "198.51.100.9")
+                    # Behind the proxy, a made-up leftmost hop does not buy a fresh bucket
+                    proxied = [await call("10.0.0.2", f"192.0.2.{n}, 198.51.100.7") for n in range(3)]
+                    neighbour = await call("10.0.0.2", "198.51.100.8")
+                    return direct, forged, proxied, neighbour
+                finally:
+                    server.rate_limiter, server.RATE_LIMIT_TRUSTED_PROXIES = saved
+            
+            direct, forged, proxied, neighbour = asyncio.run(scenario())
+            statuses = [status for status, _ in direct + [forged] + proxied + [neighbour]]
+            if statuses == [200, 200, 429, 429, 200, 200, 429, 200] and direct[2][1].get("retry-after"):
+                self.log_result("Rate Limits", True, f"429 with Retry-After {direct[2][1]['retry-after']}s once a bucket ran dry; forwarded clients counted apart")
+                return True
+            else:
+                self.log_result("Rate Limits", False, f"Statuses {statuses}")
+        except Exception as e:
+            self.log_result("Rate Limits", False, f"Error: {str(e)}")
+        return False
+    
     def test_delete_item(self, item_id):
         """Test deleting an item"""
         if not self.auth_token:
@@ -362,6 +1323,8 @@ class WallOfLoveAPITester:
         self.test_user_login_invalid()
         self.test_protected_endpoint_without_token()
         self.test_protected_endpoint_with_token()
+        self.test_auth_cache()
+        self.test_password_pool()
         
         # Public access test
         print("\n🌐 Public Access Tests")
@@ -376,12 +1339,54 @@ class WallOfLoveAPITester:
         if sticky_id1:
             self.test_update_sticky_note(sticky_id1, "Updated first sticky note")
             self.test_update_sticky_position(sticky_id1)
+            self.test_item_changes(sticky_id1)
+            self.test_coalesced_moves(sticky_id1)
+            self.test_stale_revision(sticky_id1)
+        
+        self.test_items_pagination()
+        self.test_items_viewport()
+        self.test_canvas_fields()
+        self.test_batch_operations()
+        self.test_search()
+        self.test_search_truncation()
+        self.test_lost_buffered_move()
+        
+        # Live update tests
+        print("\n📡 Live Update Tests")
+        self.test_event_stream()
+        self.test_slow_consumer_resync()
+        self.test_snapshot_coherence()
+        
+        # Caching and compression tests
+        print("\n🗜️ Caching and Compression Tests")
+        self.test_http_caching()
+        self.test_compression()
         
         # File upload tests
         print("\n📁 File Upload Tests")
         upload_result = self.test_file_upload()
         if upload_result:
             image_id = self.test_create_image_item(upload_result["url"])
+        self.test_upload_validation()
+        self.test_upload_dedup()
+        self.test_s3_storage()
+        
+        # Wall tests
+        print("\n🧱 Wall Tests")
+        self.test_wall_isolation()
+        self.test_wall_quota()
+        self.test_auto_placement()
+        
+        # Archive tests
+        print("\n📦 Archive Tests")
+        self.test_export_import()
+        self.test_import_validation()
+        
+        # Operations tests
+        print("\n📈 Operations Tests")
+        self.test_metrics()
+        self.test_profiling()
+        self.test_rate_limits()
         
         # Cleanup - delete created items
         print("\n🧹 Cleanup Tests")
@@ -16,7 +16,18 @@ function ImageCard({ item, isEditMode, onUpdate, onDelete }) {
       <div className="relative w-full overflow-hidden rounded-2xl bg-white shadow-soft">
         <img
           className="h-full w-full object-cover"
-          src={`${API_URL}${item.image_url}`}
+          src={`${API_URL}${item.variants?.medium || item.image_url}`}
+          srcSet={item.variants
+            ? `${API_URL}${item.variants.thumb} 320w, ${API_URL}${item.variants.medium} 1280w`
+            : undefined}
+          sizes="(min-width: 1280px) 20vw, (min-width: 768px) 33vw, 100vw"
+          width={item.width}
+          height={item.height}
+          loading="lazy"
+          decoding="async"
+          style={item.placeholder
+            ? { backgroundImage: `url(${item.placeholder})`, backgroundSize: 'cover' }
+            : undefined}
           alt={item.caption || 'User feedback'}
           onError={(e) => {
             e.target.src = 'https://via.placeholder.com/400x500?text=Image+Not+Found';
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
 import axios from 'axios';
@@ -10,6 +10,17 @@ import AddStickyModal from '../components/AddStickyModal';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
 
+// Apply a delta-sync batch to the current list, keeping the server's (created_at, id) order
+const mergeChanges = (items, changed, deleted) => {
+  const removed = new Set(deleted);
+  const byId = new Map(items.filter(item => !removed.has(item.id)).map(item => [item.id, item]));
+  changed.forEach(item => byId.set(item.id, item));
+  return [...byId.values()].sort((a, b) => {
+    if (a.created_at !== b.created_at) return a.created_at < b.created_at ? -1 : 1;
+    return a.id < b.id ? -1 : 1;
+  });
+};
+
 function WallCanvas() {
   const { token, isAuthenticated } = useAuth();
   const navigate = useNavigate();
@@ -21,12 +32,16 @@ function WallCanvas() {
   const [showAddStickyModal, setShowAddStickyModal] = useState(false);
   const [draggedItem, setDraggedItem] = useState(null);
   const [isDraggingFile, setIsDraggingFile] = useState(false);
+  const versionRef = useRef(null);
 
   // Fetch items from backend
   const fetchItems = useCallback(async () => {
     try {
-      const response = await axios.get(`${API_URL}/api/items`);
+      const response = await axios.get(`${API_URL}/api/items`, {
+        params: { fields: 'canvas' },
+      });
       setItems(response.data);
+      versionRef.current = Number(response.headers['x-items-version']) || 0;
     } catch (error) {
       console.error('Error fetching items:', error);
     } finally {
@@ -34,44 +49,117 @@ function WallCanvas() {
     }
   }, []);
 
+  // Pull only what changed since the last sync instead of the whole wall
+  const syncChanges = useCallback(async () => {
+    if (versionRef.current === null) {
+      return fetchItems();
+    }
+
+    try {
+      let hasMore = true;
+      while (hasMore) {
+        const response = await axios.get(`${API_URL}/api/items/changes`, {
+          params: { since: versionRef.current }
+        });
+        const { version, items: changed, deleted } = response.data;
+        if (changed.length || deleted.length) {
+          setItems(prev => mergeChanges(prev, changed, deleted));
+        }
+        versionRef.current = version;
+        hasMore = response.data.has_more;
+      }
+    } catch (error) {
+      console.error('Error syncing items:', error);
+    }
+  }, [fetchItems]);
+
   useEffect(() => {
     fetchItems();
     
     // Auto-refresh every 30 seconds for view mode
     const interval = setInterval(() => {
       if (!isEditMode) {
-        fetchItems();
+        syncChanges();
       }
     }, 30000);
     
     return () => clearInterval(interval);
-  }, [fetchItems, isEditMode]);
+  }, [fetchItems, syncChanges, isEditMode]);
 
-  const handleAddImage = async (file, caption) => {
-    if (!token) return;
+  // Live updates pushed by the server; the periodic delta sync above remains the fallback
+  useEffect(() => {
+    const source = new EventSource(`${API_URL}/api/events`);
+
+    const applyItem = (e) => {
+      const { item } = JSON.parse(e.data);
+      setItems(prev => mergeChanges(prev, [item], []));
+    };
+    const applyDelete = (e) => {
+      const { item } = JSON.parse(e.data);
+      setItems(prev => mergeChanges(prev, [], [item.id]));
+    };
+
+    source.addEventListener('created', applyItem);
+    source.addEventListener('updated', applyItem);
+    source.addEventListener('deleted', applyDelete);
+    // Catch up on anything missed while disconnected or after falling behind
+    source.addEventListener('resync', syncChanges);
+    source.onopen = syncChanges;
+
+    return () => source.close();
+  }, [syncChanges]);
+
+  // Send the file straight to object storage when the backend supports it,
+  // otherwise post it through the API
+  const uploadImage = async (file) => {
+    const authHeaders = { 'Authorization': `Bearer ${token}` };
+
+    try {
+      const { data: target } = await axios.post(`${API_URL}/api/uploads/presign`, {
+        content_type: file.type,
+        size: file.size
+      }, { headers: authHeaders });
+
+      await axios.put(target.url, file, { headers: target.headers });
+
+      const response = await axios.post(`${API_URL}/api/uploads/complete`, {
+        upload_id: target.upload_id
+      }, { headers: authHeaders });
+      return response.data;
+    } catch (error) {
+      if (error.response?.status !== 501) throw error;
+    }
 
     const formData = new FormData();
     formData.append('file', file);
 
+    const response = await axios.post(`${API_URL}/api/upload`, formData, {
+      headers: {
+        ...authHeaders,
+        'Content-Type': 'multipart/form-data'
+      }
+    });
+    return response.data;
+  };
+
+  const handleAddImage = async (file, caption) => {
+    if (!token) return;
+
     try {
       // Upload image
-      const uploadResponse = await axios.post(`${API_URL}/api/upload`, formData, {
-        headers: {
-          'Authorization': `Bearer ${token}`,
-          'Content-Type': 'multipart/form-data'
-        }
-      });
+      const uploaded = await uploadImage(file);
 
       // Create item
-      const imageUrl = uploadResponse.data.url;
+      const { url: imageUrl, width, height, placeholder, variants } = uploaded;
       const newItem = {
         type: 'image',
         image_url: imageUrl,
-        caption: caption || '',
-        position: {
-          gridColumn: Math.floor(Math.random() * 5) + 1,
-          gridRow: Math.floor(Math.random() * 3) + 1
-        }
+        width,
+        height,
+        placeholder,
+        variants,
+        caption: caption || ''
+        // No position: the server places it in the first free slot
       };
 
       const response = await axios.post(`${API_URL}/api/items`, newItem, {
@@ -92,11 +180,8 @@ function WallCanvas() {
     const newItem = {
       type: 'sticky',
       content: content,
-      background_color: backgroundColor,
-      position: {
-        gridColumn: Math.floor(Math.random() * 5) + 1,
-        gridRow: Math.floor(Math.random() * 3) + 1
-      }
+      background_color: backgroundColor
+      // No position: the server places it in the first free slot
     };
 
     try {